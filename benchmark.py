@@ -0,0 +1,126 @@
+"""This script measures the app performance targets against a local environment."""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+
+def _wait_until_ok(url: str, timeout: float)->bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.01)
+    return False
+
+def _app_env(port: int, **extra_env: str)->dict[str, str]:
+    env = {**os.environ, "PORT": str(port), "DEBUG": "FALSE", **extra_env}
+    env.setdefault("ELASTICSEARCH_URL", "http://localhost:9200")
+    env.setdefault("ELASTICSEARCH_INDEX", "fake_chinese_articles_collection_data")
+    return env
+
+@contextmanager
+def _running_app(port: int, **extra_env: str):
+    """Start the app process and wait until it is live"""
+    process = subprocess.Popen([sys.executable, "src/main.py"], env=_app_env(port, **extra_env), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not _wait_until_ok(f"http://localhost:{port}/healthz", timeout=30):
+            exit("App did not become live within 30 seconds")
+        yield process
+    finally:
+        process.terminate()
+        process.wait()
+
+def _summary(timings: list[float])->str:
+    timings = sorted(timings)
+    return f"min {timings[0]*1000:.0f}ms, median {timings[len(timings)//2]*1000:.0f}ms, max {timings[-1]*1000:.0f}ms"
+
+def measure_startup(port: int, runs: int, target: float):
+    """Start the app process and measure the time until /healthz answers"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        with _running_app(port):
+            timings.append(time.perf_counter() - start)
+    median = sorted(timings)[len(timings)//2]
+    print(f"startup time over {runs} runs: {_summary(timings)}")
+    print(f"target {target*1000:.0f}ms: {'PASS' if median <= target else 'FAIL'}")
+
+def _time_search_request(port: int, body: str)->tuple[float, float]:
+    """Return the time to first byte and the total time of one search request"""
+    conn = http.client.HTTPConnection("localhost", port)
+    start = time.perf_counter()
+    conn.request("POST", "/search-article", body=body, headers={"Content-Type": "application/x-www-form-urlencoded", "HX-Request": "true"})
+    response = conn.getresponse()
+    response.read(1)
+    ttfb = time.perf_counter() - start
+    response.read()
+    total = time.perf_counter() - start
+    conn.close()
+    return ttfb, total
+
+def measure_ttfb(port: int, runs: int, full_text: str, per_page: int):
+    """Compare time to first byte of the search result table with and without streaming"""
+    body = urllib.parse.urlencode({
+        "publisher": "", "publish_location": "", "publish_date": "", "author_name": "", "title": "",
+        "full_text": full_text, "per_page": per_page, "page_id": 0,
+    })
+    for stream in ("FALSE", "TRUE"):
+        with _running_app(port, STREAM_SEARCH_RESULTS=stream):
+            _time_search_request(port, body) # warm up elasticsearch and OpenCC
+            timings = [_time_search_request(port, body) for _ in range(runs)]
+        print(f"STREAM_SEARCH_RESULTS={stream}, per_page={per_page}, {runs} runs")
+        print(f"  time to first byte: {_summary([ttfb for ttfb, _ in timings])}")
+        print(f"  total time:         {_summary([total for _, total in timings])}")
+
+def measure_suggest(port: int, runs: int, field: str, prefixes: list[str], target: float):
+    """Measure type-ahead suggestion latency, first request of each prefix misses the hot prefix cache"""
+    with _running_app(port):
+        timings = []
+        for i in range(runs):
+            prefix = prefixes[i % len(prefixes)]
+            conn = http.client.HTTPConnection("localhost", port)
+            start = time.perf_counter()
+            conn.request("GET", f"/suggest/{field}?{urllib.parse.urlencode({field: prefix})}", headers={"HX-Request": "true"})
+            conn.getresponse().read()
+            timings.append(time.perf_counter() - start)
+            conn.close()
+    timings.sort()
+    p95 = timings[int(len(timings)*0.95)]
+    print(f"/suggest/{field} over {runs} requests: {_summary(timings)}, p95 {p95*1000:.1f}ms")
+    print(f"target p95 {target*1000:.0f}ms: {'PASS' if p95 <= target else 'FAIL'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure app performance targets')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    startup_parser = subparsers.add_parser("startup", help="time from process start until /healthz answers")
+    startup_parser.add_argument('--port', type=int, default=5055)
+    startup_parser.add_argument('--runs', type=int, default=5)
+    startup_parser.add_argument('--target', type=float, default=1.0, help='target startup time in seconds')
+    ttfb_parser = subparsers.add_parser("ttfb", help="time to first byte of the search result table")
+    ttfb_parser.add_argument('--port', type=int, default=5055)
+    ttfb_parser.add_argument('--runs', type=int, default=20)
+    ttfb_parser.add_argument('--full_text', type=str, default="中国", help='full text query, should match many long documents')
+    ttfb_parser.add_argument('--per_page', type=int, default=50)
+    suggest_parser = subparsers.add_parser("suggest", help="latency of the type-ahead suggestions")
+    suggest_parser.add_argument('--port', type=int, default=5055)
+    suggest_parser.add_argument('--runs', type=int, default=500)
+    suggest_parser.add_argument('--field', type=str, default="publisher", choices=["publisher", "author_name", "title"])
+    suggest_parser.add_argument('--prefixes', type=str, default="北,上,中,新,华,東,广,天,长,大", help='comma separated prefixes')
+    suggest_parser.add_argument('--target', type=float, default=0.01, help='target p95 latency in seconds')
+    args = parser.parse_args()
+    if args.command == "startup":
+        measure_startup(args.port, args.runs, args.target)
+    elif args.command == "ttfb":
+        measure_ttfb(args.port, args.runs, args.full_text, args.per_page)
+    elif args.command == "suggest":
+        measure_suggest(args.port, args.runs, args.field, args.prefixes.split(","), args.target)
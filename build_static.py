@@ -0,0 +1,97 @@
+"""This script builds the self-hosted static assets served by the app.
+
+It downloads the vendored JS/CSS and the Tailwind standalone CLI into static/vendor (only once,
+the directory can be copied from a connected machine for an air-gapped build), compiles a purged
+and minified Tailwind CSS file from the class names used in src/, and writes every asset under a
+content-hashed filename in static/dist together with manifest.json.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import platform
+import shutil
+import stat
+import subprocess
+import urllib.request
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent
+VENDOR_DIR = ROOT_DIR / "static" / "vendor"
+DIST_DIR = ROOT_DIR / "static" / "dist"
+TAILWIND_VERSION = "3.4.17"
+
+# asset name: (url, subresource integrity or None), versions match the CDN headers of the app
+VENDOR_ASSETS = {
+    "htmx.js": ("https://cdn.jsdelivr.net/npm/htmx.org@2.0.7/dist/htmx.min.js", None),
+    "fasthtml.js": ("https://cdn.jsdelivr.net/gh/answerdotai/fasthtml-js@1.0.12/fasthtml.js", None),
+    "jquery.js": ("https://code.jquery.com/jquery-3.7.1.slim.min.js", "sha256-kmHvs0B+OpCW5GVHUNjv9rOmY0IvSIRcf7zGUDTDQM8="),
+    "select2.css": ("https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/css/select2.min.css", None),
+    "select2.js": ("https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/js/select2.min.js", None),
+}
+
+def _download(url: str, path: Path, integrity: str|None = None):
+    if path.exists():
+        return
+    print(f"Downloading {url}")
+    with urllib.request.urlopen(url, timeout=60) as response:
+        content = response.read()
+    if integrity is not None:
+        algorithm, expected = integrity.split("-", 1)
+        actual = base64.b64encode(hashlib.new(algorithm, content).digest()).decode()
+        if actual != expected:
+            exit(f"Integrity check failed for {url}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+
+def _tailwind_cli()->Path:
+    """Download the Tailwind standalone CLI, no node installation needed"""
+    system = {"Linux": "linux", "Darwin": "macos", "Windows": "windows"}[platform.system()]
+    arch = {"x86_64": "x64", "amd64": "x64", "aarch64": "arm64", "arm64": "arm64"}[platform.machine().lower()]
+    name = f"tailwindcss-{system}-{arch}" + (".exe" if system == "windows" else "")
+    path = VENDOR_DIR / f"tailwindcss-{TAILWIND_VERSION}" / name
+    _download(f"https://github.com/tailwindlabs/tailwindcss/releases/download/v{TAILWIND_VERSION}/{name}", path)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+def build_tailwind(output: Path):
+    subprocess.run(
+        [
+            str(_tailwind_cli()),
+            "-c", str(ROOT_DIR / "tailwind.config.js"),
+            "-i", str(ROOT_DIR / "static" / "src" / "input.css"),
+            "-o", str(output),
+            "--minify",
+        ],
+        cwd=ROOT_DIR,
+        check=True,
+    )
+
+def _fingerprint(name: str, content: bytes)->str:
+    stem, suffix = name.rsplit(".", 1)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}.{suffix}"
+
+def build_static(clean: bool):
+    if clean:
+        shutil.rmtree(DIST_DIR, ignore_errors=True)
+    sources = {}
+    for name, (url, integrity) in VENDOR_ASSETS.items():
+        sources[name] = VENDOR_DIR / name
+        _download(url, sources[name], integrity)
+    sources["tailwind.css"] = VENDOR_DIR / "tailwind.css"
+    build_tailwind(sources["tailwind.css"])
+
+    DIST_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = {}
+    for name, source in sources.items():
+        content = source.read_bytes()
+        manifest[name] = _fingerprint(name, content)
+        (DIST_DIR / manifest[name]).write_bytes(content)
+        print(f"{name} -> static/dist/{manifest[name]} ({len(content)/1024:.1f}KB)")
+    (DIST_DIR / "manifest.json").write_text(json.dumps(manifest, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the fingerprinted static assets')
+    parser.add_argument('--clean', action='store_true', help='remove previously built assets')
+    args = parser.parse_args()
+    build_static(args.clean)
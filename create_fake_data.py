@@ -1,12 +1,27 @@
 """This script creates fake chinese article data using faker for the app. Loaded into elastic search, text fields will have simplified chinese version for easier searching."""
 import argparse
+import hashlib
+import itertools
+import random
+from collections import Counter
 from pprint import pp
-from elasticsearch import Elasticsearch, ConnectionError
+from elasticsearch import Elasticsearch, ConnectionError, helpers
 from faker import Faker
 from tqdm import tqdm
 import opencc
 
 FAKE_INDEX_NAME = 'fake_chinese_articles_collection_data'
+# Created by the app when the first search is saved, see src/routes/saved_search.py
+SAVED_SEARCH_INDEX_NAME = f'{FAKE_INDEX_NAME}_saved_searches'
+MAX_NEW_MATCH_IDS = 1000
+
+# Near duplicate detection: 64 bit SimHash over character shingles of the simplified full text.
+# Two documents are reprints of each other if their SimHash differ by at most SIMHASH_MAX_DISTANCE bits.
+# The SimHash is split into SIMHASH_BANDS bands, reprints share at least one band (pigeonhole),
+# so candidates are found with a terms query on the bands.
+SHINGLE_SIZE = 4
+SIMHASH_BANDS = 4
+SIMHASH_MAX_DISTANCE = SIMHASH_BANDS - 1
 fake = Faker(["zh_TW", "zh_CN"])
 text_converter = opencc.OpenCC("t2s.json")
 
@@ -15,9 +30,11 @@ INDEX_MAPPING = {
         "id": {"type": "keyword"},
         "publisher": {
             "type": "text",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}, # for facet counts and filters
         },
         "publish_location": {
             "type": "text",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
         },
         "publish_date": {"type": "date"},
         "author_name": {
@@ -31,19 +48,25 @@ INDEX_MAPPING = {
         },
         "publisher_simplified": {
             "type": "text",
+            "fields": {"suggest": {"type": "completion"}}, # prefix index for type-ahead suggestions
         },
         "publish_location_simplified": {
             "type": "text",
         },
         "author_name_simplified": {
             "type": "text",
+            "fields": {"suggest": {"type": "completion"}},
         },
         "title_simplified": {
             "type": "text",
+            "fields": {"suggest": {"type": "completion"}},
         },
         "full_text_simplified": {
             "type": "text",
         },
+        "simhash": {"type": "keyword", "index": False},
+        "simhash_bands": {"type": "keyword"},
+        "cluster_key": {"type": "keyword"}, # id of the first document of a group of reprints, results are collapsed on it
     }
 }
 
@@ -77,8 +100,25 @@ def create_fake_data_index(es: Elasticsearch):
     )
     es.indices.put_mapping(index=FAKE_INDEX_NAME, body=INDEX_MAPPING)
 
-def create_fake_article_entry(es: Elasticsearch, full_text_len: int):
-    """Create fake article entry in elasticsearch with the following entries:
+def create_fake_reprint(original: dict)->dict:
+    """Reprint of an article by another publisher, with a few characters changed"""
+    full_text = list(original["full_text"])
+    for _ in range(random.randint(0, 3)):
+        full_text[random.randrange(len(full_text))] = fake.random_letter()
+    reprint = {
+        **original,
+        "id": fake.uuid4(),
+        "publisher": fake.company(),
+        "publish_location": fake.city(),
+        "publish_date": fake.date(),
+        "full_text": "".join(full_text),
+    }
+    for field_name in ["publisher", "publish_location", "full_text"]:
+        reprint[f"{field_name}_simplified"] = text_converter.convert(reprint[field_name])
+    return reprint
+
+def create_fake_article_entry(full_text_len: int)->dict:
+    """Create fake article entry with the following entries:
     - id
     - publisher
     - publish location
@@ -98,22 +138,117 @@ def create_fake_article_entry(es: Elasticsearch, full_text_len: int):
     }
     for field_name in ["publisher", "publish_location", "author_name", "title", "full_text"]:
         fake_data[f"{field_name}_simplified"] = text_converter.convert(fake_data[field_name])
-    es.index(index=FAKE_INDEX_NAME, body=fake_data)
+    return fake_data
+
+def simhash(text: str)->int:
+    """64 bit SimHash of the character shingles of text"""
+    text = "".join(text.split())
+    shingles = (text[i:i+SHINGLE_SIZE] for i in range(max(len(text)-SHINGLE_SIZE+1, 1)))
+    digests = b"".join(hashlib.blake2b(shingle.encode(), digest_size=8).digest() for shingle in shingles)
+    # count each byte value per byte position, then expand the counts to bits,
+    # much faster than adding +1/-1 per bit per shingle in python
+    byte_counts = Counter(zip(itertools.cycle(range(8)), digests))
+    weights = [0]*64
+    for (position, value), count in byte_counts.items():
+        for bit in range(8):
+            weights[position*8 + bit] += count if value >> (7-bit) & 1 else -count
+    return sum(1 << (63-i) for i, weight in enumerate(weights) if weight > 0)
+
+def simhash_bands(value: int)->list[str]:
+    band_bits = 64 // SIMHASH_BANDS
+    return [f"{band}:{(value >> (band*band_bits)) & ((1 << band_bits) - 1):x}" for band in range(SIMHASH_BANDS)]
+
+def assign_clusters(es: Elasticsearch, documents: list[dict]):
+    """Set simhash, simhash_bands and cluster_key of new documents.
+    A document joins the cluster of an indexed (or earlier in the batch) document within SIMHASH_MAX_DISTANCE bits,
+    otherwise it starts its own cluster"""
+    for document in documents:
+        document["simhash"] = f"{simhash(document['full_text_simplified']):016x}"
+        document["simhash_bands"] = simhash_bands(int(document["simhash"], 16))
+
+    candidates_by_band: dict[str, list[dict]] = {}
+    indexed_candidates = helpers.scan(
+        es,
+        index=FAKE_INDEX_NAME,
+        query={"query": {"terms": {"simhash_bands": sorted({band for document in documents for band in document["simhash_bands"]})}}},
+        _source=["simhash", "simhash_bands", "cluster_key"],
+    )
+    for candidate in indexed_candidates:
+        for band in candidate["_source"]["simhash_bands"]:
+            candidates_by_band.setdefault(band, []).append(candidate["_source"])
+
+    for document in documents:
+        value = int(document["simhash"], 16)
+        document["cluster_key"] = document["id"]
+        for candidate in itertools.chain.from_iterable(candidates_by_band.get(band, []) for band in document["simhash_bands"]):
+            if (value ^ int(candidate["simhash"], 16)).bit_count() <= SIMHASH_MAX_DISTANCE:
+                document["cluster_key"] = candidate["cluster_key"]
+                break
+        for band in document["simhash_bands"]:
+            candidates_by_band.setdefault(band, []).append(document)
+
+def percolate_new_documents(es: Elasticsearch, documents: list[dict]):
+    """Match a batch of new documents against all saved searches in one percolate query,
+    and append the matched ids to the "new matches" of each saved search"""
+    if not es.indices.exists(index=SAVED_SEARCH_INDEX_NAME).body:
+        return
+    matches = helpers.scan(
+        es,
+        index=SAVED_SEARCH_INDEX_NAME,
+        query={"query": {"percolate": {"field": "query", "documents": documents}}},
+        _source=False,
+    )
+    updates = (
+        {
+            "_op_type": "update",
+            "_index": SAVED_SEARCH_INDEX_NAME,
+            "_id": match["_id"],
+            "script": {
+                "source": """
+                    ctx._source.saved_new_match_ids.addAll(params.ids);
+                    int size = ctx._source.saved_new_match_ids.size();
+                    if (size > params.max_ids) {
+                        ctx._source.saved_new_match_ids = new ArrayList(ctx._source.saved_new_match_ids.subList(size - params.max_ids, size));
+                    }
+                    ctx._source.saved_new_match_count += params.ids.size();
+                """,
+                "params": {
+                    "ids": [documents[slot]["id"] for slot in match["fields"]["_percolator_document_slot"]],
+                    "max_ids": MAX_NEW_MATCH_IDS,
+                },
+            },
+        }
+        for match in matches
+    )
+    helpers.bulk(es, updates)
 
-def create_fake_data(es: Elasticsearch, num_entries: int, full_text_len: int):
-    """Create fake data in elasticsearch"""
-    for i in tqdm(range(num_entries), desc="Creating fake article data"):
-        create_fake_article_entry(es, full_text_len)
+def create_fake_data(es: Elasticsearch, num_entries: int, full_text_len: int, batch_size: int, reprint_ratio: float):
+    """Create fake data in elasticsearch, indexed and percolated in batches"""
+    with tqdm(total=num_entries, desc="Creating fake article data") as progress:
+        for start in range(0, num_entries, batch_size):
+            documents = []
+            for _ in range(min(batch_size, num_entries-start)):
+                if documents and random.random() < reprint_ratio:
+                    documents.append(create_fake_reprint(random.choice(documents)))
+                else:
+                    documents.append(create_fake_article_entry(full_text_len))
+            assign_clusters(es, documents)
+            # refresh so the next batch finds these documents as near duplicate candidates
+            helpers.bulk(es, ({"_index": FAKE_INDEX_NAME, "_source": document} for document in documents), refresh="wait_for")
+            percolate_new_documents(es, documents)
+            progress.update(len(documents))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create fake data in elasticsearch')
     parser.add_argument('--url', type=str, default="http://localhost:9200", help='Elasticsearch URL')
     parser.add_argument('--num_entries', type=int, default=1000)
     parser.add_argument('--full_text_len', type=int, default=1000)
+    parser.add_argument('--batch_size', type=int, default=200, help='number of documents indexed and percolated per request')
+    parser.add_argument('--reprint_ratio', type=float, default=0.1, help='ratio of near duplicate reprints of other articles')
     args = parser.parse_args()
     es = connect_elasticsearch(args.url)
     if es is None:
         exit()
     create_fake_data_index(es)
-    create_fake_data(es, args.num_entries, args.full_text_len)
+    create_fake_data(es, args.num_entries, args.full_text_len, args.batch_size, args.reprint_ratio)
     print("Done!")
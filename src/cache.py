@@ -0,0 +1,92 @@
+"""Key-value caches shared by the search routes.
+
+`LocalCache` lives in the process memory. When the app runs with several workers,
+set `SHARED_CACHE_PATH` (e.g. a file under /dev/shm) and every cache is stored in a
+sqlite database that all workers on the machine read and write.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH")
+
+class LocalCache:
+    """Thread-safe in-process LRU cache"""
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+
+    def get(self, key: str)->tuple[Any, float]|None:
+        """Return the cached value and the unix timestamp it was stored at, None if missing"""
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._items[key] = (value, time.time())
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+class SharedCache:
+    """LRU cache stored in a sqlite database shared by all worker processes.
+    Values must be JSON serializable."""
+    def __init__(self, name: str, maxsize: int, path: str):
+        self.name = name
+        self.maxsize = maxsize
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.name} (key TEXT PRIMARY KEY, value TEXT, stored_at REAL, accessed_at REAL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_accessed_at ON {self.name} (accessed_at)")
+
+    def _connection(self)->sqlite3.Connection:
+        # sqlite connections must not be shared across threads or a fork
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def get(self, key: str)->tuple[Any, float]|None:
+        """Return the cached value and the unix timestamp it was stored at, None if missing"""
+        conn = self._connection()
+        row = conn.execute(f"SELECT value, stored_at FROM {self.name} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute(f"UPDATE {self.name} SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.name} (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now, now),
+        )
+        conn.execute(
+            f"DELETE FROM {self.name} WHERE key IN (SELECT key FROM {self.name} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+
+    def __len__(self):
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+
+def create_cache(name: str, maxsize: int)->LocalCache|SharedCache:
+    """Create a cache shared by all workers if `SHARED_CACHE_PATH` is set, otherwise an in-process one"""
+    if SHARED_CACHE_PATH:
+        return SharedCache(name, maxsize, SHARED_CACHE_PATH)
+    return LocalCache(name, maxsize)
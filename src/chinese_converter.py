@@ -1,3 +1,11 @@
+from functools import cache
 import opencc
 
-t2s = opencc.OpenCC("t2s.json")
+@cache
+def _t2s_converter()->opencc.OpenCC:
+    """Load the OpenCC dictionary on first use instead of at import time"""
+    return opencc.OpenCC("t2s.json")
+
+def t2s(text: str)->str:
+    """Convert traditional chinese text to simplified chinese"""
+    return _t2s_converter().convert(text)
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Literal
+
+BreakerState = Literal["closed", "open", "half_open"]
+
+@dataclass
+class CircuitBreakerSettings:
+    """
+    window_size (int):
+        Number of most recent calls used to compute the failure rate
+    min_calls (int):
+        Minimum number of calls in the window before the breaker is allowed to trip
+    failure_rate_threshold (float):
+        Breaker trips when the ratio of failed (or slow) calls in the window reaches this value
+    slow_call_seconds (float):
+        Calls taking longer than this are counted as failures, so a slow backend also trips the breaker
+    open_seconds (float):
+        How long the breaker stays open before a single probe call is let through (half open)
+    """
+    window_size: int = 20
+    min_calls: int = 5
+    failure_rate_threshold: float = 0.5
+    slow_call_seconds: float = 2.0
+    open_seconds: float = 30.0
+
+class CircuitBreaker:
+    """Track the outcome of calls to a backend and stop calling it while it is failing.
+
+    closed: calls go through, outcomes are recorded in a sliding window
+    open: calls are rejected until `open_seconds` have passed
+    half_open: one probe call is let through, its outcome closes or re-opens the breaker
+    """
+    def __init__(self, settings: CircuitBreakerSettings):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._outcomes: deque[bool] = deque(maxlen=settings.window_size) # True if the call failed
+        self._state: BreakerState = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.last_error: str|None = None
+
+    @property
+    def state(self)->BreakerState:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.settings.open_seconds:
+            self._state = "half_open"
+            self._probe_in_flight = False
+
+    def allow_request(self)->bool:
+        """Return True if the caller may call the backend now"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == "closed":
+                return True
+            if self._state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self, elapsed_seconds: float):
+        if elapsed_seconds > self.settings.slow_call_seconds:
+            self.record_failure(f"slow call: {elapsed_seconds:.2f}s")
+            return
+        with self._lock:
+            if self._state == "half_open":
+                self._outcomes.clear()
+                self._state = "closed"
+            self._outcomes.append(False)
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.last_error = error
+            if self._state == "half_open":
+                self._trip()
+                return
+            self._outcomes.append(True)
+            if len(self._outcomes) >= self.settings.min_calls and self.failure_rate() >= self.settings.failure_rate_threshold:
+                self._trip()
+
+    def _trip(self):
+        self._state = "open"
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._outcomes.clear()
+
+    def failure_rate(self)->float:
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def snapshot(self)->dict:
+        """State of the breaker, used by the health endpoint"""
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "failure_rate": round(self.failure_rate(), 3),
+                "recorded_calls": len(self._outcomes),
+                "seconds_until_probe": max(0.0, round(self.settings.open_seconds - (time.monotonic() - self._opened_at), 1)) if state == "open" else 0.0,
+                "last_error": self.last_error,
+            }
@@ -1,18 +1,73 @@
 import os
-from elasticsearch import Elasticsearch
+import threading
+import time
+from elasticsearch import Elasticsearch, ApiError, TransportError
 
 
 ELASTICSEARCH_URL = os.environ["ELASTICSEARCH_URL"]
+ELASTICSEARCH_REQUEST_TIMEOUT = float(os.environ.get("ELASTICSEARCH_REQUEST_TIMEOUT", 10))
+CONNECT_MAX_ATTEMPTS = int(os.environ.get("ELASTICSEARCH_CONNECT_MAX_ATTEMPTS", 10))
+CONNECT_BASE_DELAY = 0.5 # seconds, doubled after every failed attempt
+CONNECT_MAX_DELAY = 30.0
 
-def get_elasticsearch_connection(url: str):
+_es: Elasticsearch|None = None
+_es_lock = threading.Lock()
 
-    es = Elasticsearch(f"{url}")
-    try:
-        client_info = es.info()
+def get_es()->Elasticsearch:
+    """Return the elasticsearch client, creating it on first use.
+    Creating the client does not open any connection, so this never blocks on elasticsearch"""
+    global _es
+    if _es is None:
+        with _es_lock:
+            if _es is None:
+                # no retry on timeout: a slow search must fail after one timeout so the circuit
+                # breaker sees it, connect_with_retry has its own backoff
+                _es = Elasticsearch(
+                    f"{ELASTICSEARCH_URL}",
+                    request_timeout=ELASTICSEARCH_REQUEST_TIMEOUT,
+                )
+    return _es
+
+def reset_after_fork():
+    """Drop the client inherited from the parent process, so each worker opens its own connection pool"""
+    global _es, _es_lock
+    _es = None
+    _es_lock = threading.Lock()
+
+def connect_with_retry(max_attempts: int = CONNECT_MAX_ATTEMPTS, base_delay: float = CONNECT_BASE_DELAY, max_delay: float = CONNECT_MAX_DELAY)->bool:
+    """Wait for elasticsearch to answer, retrying with exponential backoff
+
+    Returns:
+        bool: True if elasticsearch answered within `max_attempts`
+    """
+    delay = base_delay
+    for attempt in range(1, max_attempts+1):
+        try:
+            get_es().info()
+        except (ApiError, TransportError) as e:
+            print(f"unable to connect to elasticsearch at {ELASTICSEARCH_URL} (attempt {attempt}/{max_attempts}): {type(e).__name__}")
+            if attempt < max_attempts:
+                time.sleep(delay)
+                delay = min(delay*2, max_delay)
+            continue
         print("Connected to Elasticsearch")
-    except ConnectionError as docker_not_spined_up:
-        print(f"unable to connect to elasticsearch, please check if your docker container is running as port {port}")
-        exit("Unable to connect to elasticsearch")
-    return es
+        return True
+    print("Giving up connecting to elasticsearch, searches run in degraded mode until it is reachable")
+    return False
 
-es = get_elasticsearch_connection(ELASTICSEARCH_URL)
+def connect_in_background():
+    """Connect to elasticsearch without blocking the app startup"""
+    threading.Thread(target=connect_with_retry, name="elasticsearch-connect", daemon=True).start()
+
+def check_ready(index: str)->tuple[bool, str]:
+    """Check elasticsearch is reachable and the search index exists
+
+    Returns:
+        tuple[bool, str]: readiness and the reason when not ready
+    """
+    try:
+        if not get_es().indices.exists(index=index).body:
+            return False, f"index {index} does not exist"
+    except (ApiError, TransportError) as e:
+        return False, f"elasticsearch unreachable: {type(e).__name__}"
+    return True, "ok"
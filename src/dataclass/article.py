@@ -3,6 +3,9 @@ from pydoc import text
 from typing import Literal
 from fasthtml.common import *
 from dataclasses import dataclass
+from urllib.parse import urlencode
+import html
+import query_compiler
 
 @dataclass
 class HighlightSettings:
@@ -107,8 +110,46 @@ def _get_highlighted_text(original_text: str, highlighted_simplified_text: list[
 
     return "".join(output_constructor)
 
+def get_highlight_spans(highlighted_simplified_text: list[str]|None, es_highlight_token: str) -> list[tuple[int, int]]:
+    """Get the offsets of the highlighted keywords, which are the same in the original text and the simplified text
+
+    Args:
+        highlighted_simplified_text (list[str] | None):
+            Elasticsearch highlighted simplified text, highlight.number_of_fragments must be 0
+        es_highlight_token (str):
+            Token used as both pre_tags and post_tags in the elasticsearch highlight
+
+    Returns:
+        list[tuple[int, int]]: sorted (start, end) offsets of the keywords
+    """
+    if highlighted_simplified_text is None:
+        return []
+    spans = []
+    pos = 0
+    for i, simplified_text in enumerate(highlighted_simplified_text[0].split(es_highlight_token)):
+        if i%2: # keyword
+            spans.append((pos, pos+len(simplified_text)))
+        pos += len(simplified_text)
+    return spans
+
+def render_highlighted_chunk(original_text: str, spans: list[tuple[int, int]], start: int, end: int, highlight_settings: HighlightSettings) -> str:
+    """Render original_text[start:end] as escaped html with the keywords in `spans` highlighted"""
+    output_constructor: list[str] = []
+    pos = start
+    for span_start, span_end in spans:
+        if span_end <= start or span_start >= end:
+            continue
+        span_start, span_end = max(span_start, start), min(span_end, end)
+        output_constructor.append(html.escape(original_text[pos:span_start]))
+        output_constructor.append(highlight_settings.start_token)
+        output_constructor.append(html.escape(original_text[span_start:span_end]))
+        output_constructor.append(highlight_settings.end_token)
+        pos = span_end
+    output_constructor.append(html.escape(original_text[pos:end]))
+    return "".join(output_constructor)
+
 TEXT_FIELDS = ["publisher", "publish_location", "author_name", "title", "full_text"]
-TEXT_FIELD_INVALID_MSG = "no consecutive '&', '|'"
+TEXT_FIELD_INVALID_MSG = "keywords joined by '&', '|', with balanced brackets"
 DATE_FIELD_INVALID_MSG = "Accepted date format: YYYY, YYYYMM, YYYY-YYYY, YYYYMM-YYYYMM"
 
 @dataclass
@@ -125,19 +166,13 @@ class ArticleSearchQuery:
 
     def get_errors(self)->dict[str, str]:
         """Check if query is valid, return error messages if not valid.
-        Query is valid if there are no consecutive &|, parsing brackets is complicated
-        And the date format is correct
+        Text fields must be valid keyword queries (see query_compiler) and the date format must be correct
         """
-        # TODO: support brackets
-        invalid_pattern = "|".join([
-            r"([&|]{2,})", # check if there are consecutive symbols
-            r"^[&|]", # start with operator
-            r"[&|]$", # end with operator
-        ])
         errors = {}
         for name in TEXT_FIELDS:
-            if re.search(invalid_pattern, getattr(self, name)):
-                errors[name] = TEXT_FIELD_INVALID_MSG
+            value = getattr(self, name)
+            if value.strip() and (error := query_compiler.validate(value)):
+                errors[name] = str(error)
 
         valid_date_patterns = "|".join([
             r"^(\d{4})$",
@@ -149,15 +184,6 @@ class ArticleSearchQuery:
             errors["publish_date"] = DATE_FIELD_INVALID_MSG
 
         return errors
-        # bracket_count = 0
-        # for char in query:
-        #     if char == "(":
-        #         bracket_count += 1
-        #     elif char == ")":
-        #         bracket_count -= 1
-        #     if bracket_count > 1:
-        #         return False
-        # return bracket_count == 0
 
     def parse_date(self)->tuple[str, str]:
         """Parse publish_date into start and end. Accepted format:
@@ -196,6 +222,39 @@ class ArticleSearchQuery:
             ])
         )
 
+FACET_FIELDS = ["publisher", "publish_location"]
+FACET_DATE_INVALID_MSG = "Accepted date facet format: YYYY, YYYY-MM"
+
+@dataclass
+class FacetFilters:
+    """Filters added by clicking a facet, they narrow the results without changing the text query
+    facet_publish_date is a histogram bucket: YYYY or YYYY-MM
+    """
+    facet_publisher: str = ""
+    facet_publish_location: str = ""
+    facet_publish_date: str = ""
+
+    def get_errors(self)->dict[str, str]:
+        """The facet values come from the client, the date must be a histogram bucket key"""
+        if self.facet_publish_date and not re.search(r"^\d{4}(-(0[1-9]|1[0-2]))?$", self.facet_publish_date):
+            return {"facet_publish_date": FACET_DATE_INVALID_MSG}
+        return {}
+
+    def to_elastic_search_filters(self)->list[dict]:
+        """Filter context clauses, they are not scored and elasticsearch can cache them"""
+        filters = []
+        for name in FACET_FIELDS:
+            if value := getattr(self, f"facet_{name}"):
+                filters.append({"term": {f"{name}.keyword": value}})
+        if self.facet_publish_date:
+            date_format, interval = ("yyyy", "y") if len(self.facet_publish_date) == 4 else ("yyyy-MM", "M")
+            filters.append({"range": {"publish_date": {
+                "gte": self.facet_publish_date,
+                "lt": f"{self.facet_publish_date}||+1{interval}",
+                "format": date_format,
+            }}})
+        return filters
+
 @dataclass
 class Article:
     id: str
@@ -205,15 +264,19 @@ class Article:
     author_name: str
     title: str
     full_text: str
+    full_text_query: str = "" # highlighted in the document viewer
+    reprint_count: int = 0 # near duplicates collapsed into this article
 
     @classmethod
-    def from_elastic_search_response(cls, es_query_res: dict[Literal["_source", "highlight"], Any], highlight_settings: HighlightSettings):
+    def from_elastic_search_response(cls, es_query_res: dict[Literal["_source", "highlight"], Any], highlight_settings: HighlightSettings, full_text_query: str = ""):
+        """`_source.full_text` is only needed when the full text is highlighted,
+        otherwise the full text is left to the document viewer"""
         if "highlight" not in es_query_res:
             es_query_res["highlight"] = {}
         if highlighted_full_text := es_query_res["highlight"].get("full_text_simplified"):
             displayed_full_text = _get_highlighted_text(es_query_res["_source"]["full_text"], highlighted_full_text, highlight_settings)
         else:
-            displayed_full_text = "Full text too long to be displayed, please provide search for a keyword in full text"
+            displayed_full_text = "Open the source file to read the full text"
         return cls(
             id=es_query_res["_source"]["id"],
             publisher=_get_highlighted_text(es_query_res["_source"]["publisher"], es_query_res["highlight"].get("publisher_simplified"), highlight_settings),
@@ -222,8 +285,14 @@ class Article:
             author_name=_get_highlighted_text(es_query_res["_source"]["author_name"], es_query_res["highlight"].get("author_name_simplified"), highlight_settings),
             title=_get_highlighted_text(es_query_res["_source"]["title"], es_query_res["highlight"].get("title_simplified"), highlight_settings),
             full_text=displayed_full_text,
+            full_text_query=full_text_query,
+            reprint_count=max(es_query_res.get("inner_hits", {}).get("reprints", {}).get("hits", {}).get("total", {}).get("value", 1) - 1, 0),
         )
 
+    @property
+    def document_url(self)->str:
+        return f"/document/{self.id}?{urlencode({'q': self.full_text_query})}"
+
     def __ft__(self):
         """The __ft__ method renders the dataclass at runtime."""
         return Div(
@@ -248,7 +317,8 @@ class ArticleRow(Article):
             Td(Safe(self.title)),
             Td(Safe(self.full_text)),
             Td(
-                A("link", href="#", target="_blank"), # open the document in a new tab
+                A("link", href=self.document_url, target="_blank"), # open the document in a new tab
+                P(f"+{self.reprint_count} reprints", cls="text-xs text-gray-600") if self.reprint_count else None,
                 cls="text-blue-600"
             ),
             cls=[
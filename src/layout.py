@@ -1,8 +1,10 @@
 from fasthtml.common import *
 
+APP_TITLE = "Chinese Doc Search"
+
 def base_layout(*args, **kwargs):
     return Body(
-        Nav(H1("Chinese Doc Search")),
+        Nav(H1(APP_TITLE)),
         Div(*args, **kwargs,
             cls=[
                 "block",
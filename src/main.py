@@ -1,42 +1,65 @@
+import time
+_startup_begin = time.perf_counter()
+
 import os
 from dotenv import load_dotenv
 from fasthtml.common import *
 
 load_dotenv()
 
+import database
+import profiling
+import static_assets
+import workers
+from layout import APP_TITLE
 from routes import (
     entry,
     display_table,
     search_article,
+    health,
+    document,
+    suggest,
+    saved_search,
 )
 
-
+# Importing the app must stay cheap: no network calls and no dictionary loading,
+# elasticsearch is connected in the background and OpenCC is loaded on first use
+STARTUP_TIME_TARGET_SECONDS = float(os.environ.get("STARTUP_TIME_TARGET_SECONDS", 1.0))
+WORKERS = int(os.environ.get("WORKERS", 1))
 
 debug = os.environ["DEBUG"].upper() == "TRUE"
 app = FastHTML(
-    title="Chinese Doc Search",
+    title=APP_TITLE,
     debug=debug,
     pico=False, # disable pico css, only use Tailwind
-    hdrs=(
-        # JQuery
-        Script(
-            src="https://code.jquery.com/jquery-3.7.1.slim.min.js",
-            integrity="sha256-kmHvs0B+OpCW5GVHUNjv9rOmY0IvSIRcf7zGUDTDQM8=",
-            crossorigin="anonymous"
-        ),
-
-        # Select2
-        Link(rel="stylesheet", href="https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/css/select2.min.css"),
-        Script(src="https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/js/select2.min.js"),
-
-        # Tailwind
-        Script(src="https://cdn.tailwindcss.com")
-    )
+    on_startup=[database.connect_in_background],
+    before=profiling.beforeware(),
+    default_hdrs=False, # htmx and fasthtml.js are self-hosted with the other assets
+    hdrs=static_assets.page_headers(),
 )
 
+app.get("/static/dist/{fname}")(static_assets.static_asset)
 app.get("/")(entry.home)
-app.get("/display")(display_table.display_table)
+app.get("/display")(profiling.profile_handler(display_table.display_table))
+app.get("/display/rows")(profiling.profile_handler(display_table.display_rows))
 app.get("/search-article-page")(search_article.article_search_page)
-app.post("/search-article")(search_article.search_article)
+app.post("/search-article")(profiling.profile_handler(search_article.search_article))
+app.get("/document/{doc_id}")(document.document_page)
+app.get("/document/{doc_id}/chunk")(document.document_chunk)
+app.get("/suggest/{field}")(suggest.suggest)
+app.get("/saved-searches")(saved_search.saved_searches_panel)
+app.post("/saved-searches")(saved_search.save_search)
+app.post("/saved-searches/{saved_id}/new-matches")(saved_search.show_new_matches)
+app.get("/health")(health.health)
+app.get("/healthz")(health.healthz)
+app.get("/readyz")(health.readyz)
+
+startup_seconds = time.perf_counter() - _startup_begin
+print(f"App loaded in {startup_seconds*1000:.0f}ms (target {STARTUP_TIME_TARGET_SECONDS*1000:.0f}ms)")
+if startup_seconds > STARTUP_TIME_TARGET_SECONDS:
+    print("Warning: app startup is slower than the target, check for import-time work")
 
-serve()
+if WORKERS > 1 and __name__ == "__main__":
+    workers.serve_workers(app, WORKERS)
+else:
+    serve(reload=debug)
@@ -0,0 +1,222 @@
+"""On demand profiling of slow request handlers.
+
+A request is profiled when it carries PROFILING_TOKEN (`X-Profile-Token` header, or
+`profile_token` query parameter of the request or of the page that sent the htmx request),
+or at random with PROFILING_SAMPLE_RATE. The handler thread is sampled by a stack sampler and
+the profile is written to PROFILE_DIR as `<profile id>.folded`, one collapsed stack per line,
+ready for flamegraph.pl or speedscope. The profile id is the `X-Request-ID` header followed by a
+random suffix, so clients cannot overwrite each other's profiles, and is returned in the
+`X-Profile-Id` response header. Only the PROFILE_MAX_FILES most recent profiles are kept.
+
+When neither PROFILING_TOKEN nor PROFILING_SAMPLE_RATE is set, `profile_handler` returns the
+handler unchanged and no Beforeware is installed.
+"""
+import functools
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from urllib.parse import parse_qs, urlparse
+from fasthtml.common import *
+
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0))
+PROFILING_INTERVAL_SECONDS = float(os.environ.get("PROFILING_INTERVAL_SECONDS", 0.002))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 200))
+ENABLED = bool(PROFILING_TOKEN) or PROFILING_SAMPLE_RATE > 0
+
+# FastHTML moves these tags to the page head, they are not rendered by the profiled handler
+_HEAD_TAGS = ("title", "meta", "link", "style", "base")
+
+_active_profile: ContextVar["RequestProfile|None"] = ContextVar("active_profile", default=None)
+
+def _frame_label(frame)->str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _collapse(frame)->str:
+    """Collapsed stack of a frame, outermost call first"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+class StackSampler:
+    """Samples the stacks of the registered threads at a fixed interval"""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._thread_ids: set[int] = set()
+        self._stop = threading.Event()
+        self._thread: threading.Thread|None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in tuple(self._thread_ids):
+                if (frame := frames.get(thread_id)) is not None:
+                    self.samples[_collapse(frame)] += 1
+
+    @contextmanager
+    def sampling(self):
+        """Sample the current thread inside the block"""
+        thread_id = threading.get_ident()
+        self._thread_ids.add(thread_id)
+        try:
+            yield
+        finally:
+            self._thread_ids.discard(thread_id)
+
+@dataclass
+class RequestProfile:
+    profile_id: str
+    method: str
+    path: str
+    sampler: StackSampler = field(default_factory=lambda: StackSampler(PROFILING_INTERVAL_SECONDS))
+    started_at: float = field(default_factory=time.perf_counter)
+
+    def finish(self):
+        """Stop sampling and write the collapsed stacks"""
+        self.sampler.stop()
+        elapsed = time.perf_counter() - self.started_at
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{self.profile_id}.folded")
+        with open(path, "w") as f:
+            for stack, count in self.sampler.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profiled {self.method} {self.path} ({elapsed*1000:.0f}ms, {self.sampler.samples.total()} samples): {path}")
+        _remove_old_profiles()
+
+def _remove_old_profiles():
+    """Keep the PROFILE_MAX_FILES most recent profiles"""
+    paths = []
+    for entry in os.scandir(PROFILE_DIR):
+        if entry.name.endswith(".folded"):
+            try:
+                paths.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError: # removed by another worker
+                pass
+    paths.sort(reverse=True)
+    for _, path in paths[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _has_token(req)->bool:
+    if not PROFILING_TOKEN:
+        return False
+    tokens = [req.headers.get("x-profile-token", ""), req.query_params.get("profile_token", "")]
+    # htmx requests do not repeat the query string of the page they are sent from
+    if current_url := req.headers.get("hx-current-url"):
+        tokens += parse_qs(urlparse(current_url).query).get("profile_token", [])
+    # compare bytes, compare_digest only accepts ASCII strings
+    return any(hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode()) for token in tokens if token)
+
+def _profile_id(req)->str:
+    """Request id with a random suffix, the `X-Request-ID` header is chosen by the client"""
+    suffix = uuid.uuid4().hex
+    if request_id := req.headers.get("x-request-id"):
+        return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', request_id)[:64]}-{suffix[:12]}"
+    return suffix
+
+async def _select_for_profiling(req):
+    # async so the context variable is set in the request task, the handler runs in a copy of its context
+    if _has_token(req) or random.random() < PROFILING_SAMPLE_RATE:
+        _active_profile.set(RequestProfile(_profile_id(req), req.method, req.url.path))
+
+def beforeware():
+    """Beforeware selecting the requests to profile, None when profiling is disabled"""
+    if not ENABLED:
+        return None
+    return Beforeware(_select_for_profiling, skip=[r"/static/.*", "/healthz", "/readyz", "/health"])
+
+def _prerender(part):
+    """Render FT components while the handler thread is sampled, FastHTML renders them after the handler returns otherwise"""
+    if isinstance(part, FT) and part.tag == "body":
+        part.children = tuple(_prerender(child) for child in part.children)
+        return part
+    if (isinstance(part, FT) or hasattr(part, "__ft__")) and getattr(part, "tag", "") not in _HEAD_TAGS:
+        return Safe(to_xml(part))
+    return part
+
+async def _finish_after_body(body_iterator, profile: RequestProfile):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        profile.finish()
+
+def profile_iterator(iterator):
+    """Sample the threads consuming `iterator`, used for streamed response bodies
+
+    Args:
+        iterator: synchronous iterator passed to a StreamingResponse
+
+    Returns:
+        the same iterator when the request is not profiled
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return iterator
+    def _sampled():
+        iterator_ = iter(iterator)
+        while True:
+            with profile.sampler.sampling():
+                try:
+                    item = next(iterator_)
+                except StopIteration:
+                    return
+            yield item
+    return _sampled()
+
+def profile_handler(handler):
+    """Profile a synchronous route handler for the requests selected by the Beforeware"""
+    if not ENABLED:
+        return handler
+
+    @functools.wraps(handler)
+    def _profiled_handler(*args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None:
+            return handler(*args, **kwargs)
+        profile.sampler.start()
+        try:
+            with profile.sampler.sampling():
+                result = handler(*args, **kwargs)
+                if isinstance(result, StreamingResponse):
+                    # the body is rendered while it is sent, sampling stops once it is done
+                    result.headers["X-Profile-Id"] = profile.profile_id
+                    result.body_iterator = _finish_after_body(result.body_iterator, profile)
+                    return result
+                if isinstance(result, Response):
+                    result.headers["X-Profile-Id"] = profile.profile_id
+                    profile.finish()
+                    return result
+                parts = result if isinstance(result, tuple) else (result,)
+                result = (*map(_prerender, parts), HttpHeader("X-Profile-Id", profile.profile_id))
+        except BaseException:
+            profile.finish()
+            raise
+        profile.finish()
+        return result
+    return _profiled_handler
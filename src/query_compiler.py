@@ -0,0 +1,243 @@
+"""Boolean keyword queries typed in the search form, e.g. `(中国|香港)&北京`.
+
+Grammar, `&` binds tighter than `|`:
+    or_expr  := and_expr ("|" and_expr)*
+    and_expr := term ("&" term)*
+    term     := "(" or_expr ")" | keyword
+
+A keyword is a run of characters other than `&|()`, with surrounding whitespace removed.
+Queries are parsed to an AST, simplified (flattening, deduplication, absorption) and
+compiled to elasticsearch bool queries of `match_phrase` clauses.
+
+VALIDATE_QUERY_JS implements the same rules for the search form, keep the error messages
+of both in sync (tests/test_query_compiler.py compares them).
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+
+OPERATORS = "&|()"
+
+# Compiled queries of recently searched expressions, per field
+COMPILED_QUERY_CACHE_SIZE = 1024
+
+# `validateQuery(query)` for the search form, returns the error message of `validate`, "" if valid
+VALIDATE_QUERY_JS = """
+    validateQuery = function(query) {
+        if (query.trim() === "") {
+            return "";
+        }
+        const at = (position) => position === null ? "at the end" : "at character " + (position + 1);
+        let expectKeyword = true;
+        let openBrackets = [];
+        let i = 0;
+        while (i < query.length) {
+            const char = query[i];
+            if (char === "(") {
+                if (!expectKeyword) return "missing '&' or '|' " + at(i);
+                openBrackets.push(i);
+            } else if (char === ")") {
+                if (expectKeyword) return "missing keyword " + at(i);
+                if (openBrackets.length === 0) return "unmatched ')' " + at(i);
+                openBrackets.pop();
+            } else if (char === "&" || char === "|") {
+                if (expectKeyword) return "missing keyword " + at(i);
+                expectKeyword = true;
+            } else if (char.trim() !== "") {
+                if (!expectKeyword) return "missing '&' or '|' " + at(i);
+                /* a keyword runs until the next operator or bracket */
+                while (i + 1 < query.length && !"&|()".includes(query[i + 1])) i++;
+                expectKeyword = false;
+            }
+            i++;
+        }
+        if (expectKeyword) return "missing keyword " + at(null);
+        if (openBrackets.length > 0) return "unmatched '(' " + at(openBrackets[openBrackets.length - 1]);
+        return "";
+    }
+"""
+
+class QuerySyntaxError(ValueError):
+    def __init__(self, message: str, position: int|None):
+        """
+        Args:
+            message (str): error message
+            position (int | None): 0-based offset of the error in the query, None for the end of the query
+        """
+        self.position = position
+        location = "at the end" if position is None else f"at character {position+1}"
+        super().__init__(f"{message} {location}")
+
+@dataclass(frozen=True)
+class Keyword:
+    text: str
+
+@dataclass(frozen=True)
+class And:
+    children: tuple
+
+@dataclass(frozen=True)
+class Or:
+    children: tuple
+
+Node = Keyword|And|Or
+
+@dataclass(frozen=True)
+class _Token:
+    kind: str # one of OPERATORS, or "keyword"
+    text: str
+    position: int
+
+def _tokenize(query: str)->list[_Token]:
+    tokens = []
+    keyword_start = None
+    for position, char in enumerate(query + "&"): # sentinel operator ends the last keyword
+        if char not in OPERATORS:
+            if keyword_start is None:
+                keyword_start = position
+            continue
+        if keyword_start is not None:
+            text = query[keyword_start:position]
+            if text.strip():
+                # report the position of the first non blank character
+                tokens.append(_Token("keyword", text.strip(), keyword_start + len(text) - len(text.lstrip())))
+            keyword_start = None
+        if position < len(query):
+            tokens.append(_Token(char, char, position))
+    return tokens
+
+class _Parser:
+    """Recursive descent parser over the tokens of one query"""
+    def __init__(self, tokens: list[_Token]):
+        self.tokens = tokens
+        self.index = 0
+
+    def _peek(self)->_Token|None:
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def parse(self)->Node:
+        node = self._or_expr()
+        if (token := self._peek()) is not None:
+            if token.kind == ")":
+                raise QuerySyntaxError("unmatched ')'", token.position)
+            raise QuerySyntaxError("missing '&' or '|'", token.position)
+        return node
+
+    def _or_expr(self)->Node:
+        children = [self._and_expr()]
+        while (token := self._peek()) is not None and token.kind == "|":
+            self.index += 1
+            children.append(self._and_expr())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def _and_expr(self)->Node:
+        children = [self._term()]
+        while (token := self._peek()) is not None and token.kind == "&":
+            self.index += 1
+            children.append(self._term())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def _term(self)->Node:
+        token = self._peek()
+        if token is None:
+            raise QuerySyntaxError("missing keyword", None)
+        if token.kind == "keyword":
+            self.index += 1
+            return Keyword(token.text)
+        if token.kind != "(":
+            raise QuerySyntaxError("missing keyword", token.position)
+        self.index += 1
+        node = self._or_expr()
+        closing = self._peek()
+        if closing is None:
+            raise QuerySyntaxError("unmatched '('", token.position)
+        if closing.kind != ")":
+            raise QuerySyntaxError("missing '&' or '|'", closing.position)
+        self.index += 1
+        return node
+
+def to_expression(node: Node)->str:
+    """Query string of an AST, with the brackets needed by the operator precedence only"""
+    if isinstance(node, Keyword):
+        return node.text
+    if isinstance(node, And):
+        return "&".join(f"({to_expression(child)})" if isinstance(child, Or) else to_expression(child) for child in node.children)
+    return "|".join(to_expression(child) for child in node.children)
+
+def _operands(node: Node)->frozenset:
+    """Operands of an AND, a single operand otherwise"""
+    return frozenset(node.children) if isinstance(node, And) else frozenset([node])
+
+def _alternatives(node: Node)->frozenset:
+    """Alternatives of an OR, a single alternative otherwise"""
+    return frozenset(node.children) if isinstance(node, Or) else frozenset([node])
+
+def simplify(node: Node)->Node:
+    """Equivalent AST without redundant clauses, with children in a canonical order
+
+    - flattening: a&(b&c) -> a&b&c
+    - deduplication: a|a -> a
+    - absorption: a|a&b -> a, a&(a|b) -> a
+    """
+    if isinstance(node, Keyword):
+        return node
+    node_type = type(node)
+    children = []
+    for child in map(simplify, node.children):
+        children.extend(child.children if isinstance(child, node_type) else [child])
+    children = list(dict.fromkeys(children))
+
+    # a child is redundant when another child is implied by it (OR) or implies it (AND)
+    group = _operands if node_type is Or else _alternatives
+    groups = [group(child) for child in children]
+    children = [
+        child for i, child in enumerate(children)
+        if not any(j != i and groups[j] < groups[i] for j in range(len(children)))
+    ]
+
+    children.sort(key=to_expression)
+    if len(children) == 1:
+        return children[0]
+    return node_type(tuple(children))
+
+@lru_cache(maxsize=COMPILED_QUERY_CACHE_SIZE)
+def parse_query(query: str)->Node:
+    """Parse and simplify a query
+
+    Raises:
+        QuerySyntaxError: the query is empty or invalid
+    """
+    return simplify(_Parser(_tokenize(query)).parse())
+
+def validate(query: str)->QuerySyntaxError|None:
+    try:
+        parse_query(query)
+    except QuerySyntaxError as e:
+        return e
+    return None
+
+def _compile_node(node: Node, field: str)->dict:
+    if isinstance(node, Keyword):
+        return {"match_phrase": {field: node.text}}
+    if isinstance(node, And):
+        return {"bool": {"must": [_compile_node(child, field) for child in node.children]}}
+    return {"bool": {"should": [_compile_node(child, field) for child in node.children], "minimum_should_match": 1}}
+
+@lru_cache(maxsize=COMPILED_QUERY_CACHE_SIZE)
+def _compile_simplified(node: Node, field: str)->dict:
+    # simplified ASTs are equal when their normalized expressions are, so they are the cache key
+    return _compile_node(node, field)
+
+def compile_query(query: str, field: str)->dict:
+    """Compile a user query to an elasticsearch query on `field`
+
+    Args:
+        query (str): User input query containing keywords, `&`, `|` and brackets
+        field (str): target field of the match_phrase clauses
+
+    Returns:
+        dict: elasticsearch query, shared by the cache and must not be modified
+
+    Raises:
+        QuerySyntaxError: the query is empty or invalid
+    """
+    return _compile_simplified(parse_query(query), field)
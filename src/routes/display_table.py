@@ -1,41 +1,86 @@
 import os
+import time
+from urllib.parse import urlencode
 from fasthtml.common import *
-from database import es
+import cache
+import search_backend
 from dataclass.article import ArticleRow
 from layout import base_layout
+from routes.search_article import ARTICLE_TABLE_HEAD, ARTICLE_TABLE_CLS, HIGHLIGHT_SETTINGS
 
-def display_table():
-    """Returns a table of first 10 entries in the database"""
+# Rows loaded per request, the next rows are loaded when the last row is scrolled into view
+BROWSE_PAGE_SIZE = 50
+# Keyset order of the corpus, the id breaks ties between documents published the same day
+BROWSE_SORT = [{"publish_date": {"order": "desc"}}, {"id": {"order": "asc"}}]
+# Only the displayed columns are fetched, the full text is read in the document viewer
+BROWSE_SOURCE_FIELDS = ["id", "publisher", "publish_location", "publish_date", "author_name", "title"]
+
+# Counting the whole index is not needed for every page, the count is refreshed after the TTL
+DOCUMENT_COUNT_TTL_SECONDS = 60
+document_count_cache = cache.create_cache("document_count", 1)
+
+def _document_count()->int|None:
+    """Number of documents in the index, None if elasticsearch is unavailable"""
+    cached = document_count_cache.get("count")
+    if cached is not None and time.time() - cached[1] < DOCUMENT_COUNT_TTL_SECONDS:
+        return cached[0]
+    try:
+        search_result = search_backend.search(
+            os.environ["ELASTICSEARCH_INDEX"],
+            {"size": 0, "track_total_hits": True},
+            stale_fallback=False, # document_count_cache keeps the last count
+        )
+    except search_backend.SearchUnavailableError:
+        return cached[0] if cached is not None else None
+    count = search_result.response["hits"]["total"]["value"]
+    document_count_cache.set("count", count)
+    return count
+
+def _browse_rows(search_after: list|None):
+    """One page of rows in keyset order, followed by a row loading the next page when revealed
 
-    response = es.search(
-        index=os.environ["ELASTICSEARCH_INDEX"],
-        body={
-            "query": {
-                "match_all": {}
-            },
-            "size": 10,
-            "from": 10,
-        }
+    Args:
+        search_after (list | None): sort values of the last displayed document, None for the first page
+    """
+    es_search_body = {
+        "query": {"match_all": {}},
+        "sort": BROWSE_SORT,
+        "size": BROWSE_PAGE_SIZE,
+        "_source": BROWSE_SOURCE_FIELDS,
+        "track_total_hits": False, # the total is counted separately and cached
+    }
+    if search_after is not None:
+        es_search_body["search_after"] = search_after
+    try:
+        # every scrolled page has its own search_after, they would evict the search results from the stale result cache
+        search_result = search_backend.search(os.environ["ELASTICSEARCH_INDEX"], es_search_body, stale_fallback=False)
+    except search_backend.SearchUnavailableError as e:
+        return (Tr(Td(str(e), colspan=7, cls="p-4 text-center")),)
+    hits = search_result.response["hits"]["hits"]
+    rows = [ArticleRow.from_elastic_search_response(hit, HIGHLIGHT_SETTINGS) for hit in hits]
+    if len(hits) < BROWSE_PAGE_SIZE:
+        return tuple(rows)
+    after_date, after_id = hits[-1]["sort"]
+    next_page = Tr(
+        Td("Loading...", colspan=7, cls="p-4 text-center text-gray-500"),
+        hx_get=f"/display/rows?{urlencode({'after_date': after_date, 'after_id': after_id})}",
+        hx_trigger="revealed",
+        hx_swap="outerHTML",
     )
-    result = [item["_source"] for item in response["hits"]["hits"]]
+    return (*rows, next_page)
+
+def display_table():
+    """Browse the whole corpus, newest documents first"""
+    document_count = _document_count()
     return base_layout(
+        P(f"{document_count:,} documents" if document_count is not None else "", cls="m-4"),
         Table(
-            Thead(
-                Tr(Th(name, scope="col") for name in ("Publisher", "Publish Location", "Publish Date", "Author Name", "Title", "Full Text", "Source File")),
-                cls=[
-                    "text-s",
-                    "uppercase",
-                    "bg-gray-500",
-                ]
-            ),
-            Tbody(
-                *(ArticleRow.from_elastic_search_response(item) for item in result),
-            ),
-            cls=[
-                "table-auto",
-                "w-11/12",
-                "border-8",
-                "text-l",
-            ]
-        )
+            ARTICLE_TABLE_HEAD,
+            Tbody(*_browse_rows(None)),
+            cls=ARTICLE_TABLE_CLS,
+        ),
     )
+
+def display_rows(after_date: int, after_id: str):
+    """Rows after the document with sort values (after_date, after_id), requested by infinite scroll"""
+    return _browse_rows([after_date, after_id])
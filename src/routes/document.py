@@ -0,0 +1,113 @@
+import os
+from urllib.parse import urlencode
+from fasthtml.common import *
+from layout import base_layout
+import cache
+import chinese_converter
+import query_compiler
+import search_backend
+from dataclass.article import (
+    get_highlight_spans,
+    render_highlighted_chunk,
+)
+from routes.search_article import HIGHLIGHT_SETTINGS
+
+# Number of characters sent per chunk, more chunks are loaded when the user scrolls to the end
+CHUNK_SIZE = 2000
+
+# Full text and keyword offsets of recently viewed documents, so scrolling does not query elasticsearch again
+document_cache = cache.create_cache("documents", 64)
+
+def _load_document(doc_id: str, q: str)->tuple[dict, list[tuple[int, int]]]|None:
+    """Fetch one document and the offsets of the full text keywords in `q`
+
+    Returns:
+        tuple[dict, list[tuple[int, int]]] | None: document source and keyword offsets, None if not found
+    """
+    cache_key = f"{doc_id}\n{q}"
+    if cached := document_cache.get(cache_key):
+        source, spans = cached[0]
+        return source, [tuple(span) for span in spans]
+
+    es_search_body = {
+        "query": {"term": {"id": doc_id}},
+        "size": 1,
+        "_source": {"excludes": ["*_simplified"]},
+    }
+    # ignore invalid queries, the document is still displayed without highlight
+    if q and not query_compiler.validate(q):
+        es_search_body["highlight"] = {
+            "pre_tags": [HIGHLIGHT_SETTINGS.es_highlight_token],
+            "post_tags": [HIGHLIGHT_SETTINGS.es_highlight_token],
+            "number_of_fragments": 0,
+            "fields": {
+                "full_text_simplified": {
+                    "highlight_query": query_compiler.compile_query(chinese_converter.t2s(q), "full_text_simplified"),
+                },
+            },
+        }
+    # document_cache serves the chunks of the document while it is scrolled, not the stale result cache
+    search_result = search_backend.search(os.environ["ELASTICSEARCH_INDEX"], es_search_body, stale_fallback=False)
+    hits = search_result.response["hits"]["hits"]
+    if not hits:
+        return None
+    source = hits[0]["_source"]
+    spans = get_highlight_spans(hits[0].get("highlight", {}).get("full_text_simplified"), HIGHLIGHT_SETTINGS.es_highlight_token)
+    document_cache.set(cache_key, (source, spans))
+    return source, spans
+
+def _chunk_end(spans: list[tuple[int, int]], start: int, text_len: int)->int:
+    """End of the chunk starting at `start`, extended so a keyword is never split across two chunks"""
+    end = min(start+CHUNK_SIZE, text_len)
+    for span_start, span_end in spans:
+        if span_start < end < span_end:
+            return span_end
+    return end
+
+def _render_chunk(doc_id: str, q: str, source: dict, spans: list[tuple[int, int]], offset: int):
+    full_text = source["full_text"]
+    end = _chunk_end(spans, offset, len(full_text))
+    next_chunk = None if end >= len(full_text) else Div(
+        "Loading...",
+        hx_get=f"/document/{doc_id}/chunk?{urlencode({'q': q, 'offset': end})}",
+        hx_trigger="revealed",
+        hx_swap="outerHTML",
+        cls="text-gray-500",
+    )
+    return Span(Safe(render_highlighted_chunk(full_text, spans, offset, end, HIGHLIGHT_SETTINGS))), next_chunk
+
+def document_page(doc_id: str, q: str = ""):
+    """Display one document, the full text is loaded in chunks while scrolling"""
+    try:
+        document = _load_document(doc_id, q)
+    except search_backend.SearchUnavailableError as e:
+        return base_layout(P(str(e)))
+    if document is None:
+        return base_layout(P(f"Document {doc_id} not found"))
+    source, spans = document
+    return base_layout(
+        Table(
+            Tbody(*[
+                Tr(
+                    Td(field.replace("_", " ").title(), cls="font-bold pr-4"),
+                    Td(source.get(field) or '-'),
+                ) for field in ("publisher", "publish_location", "publish_date", "author_name", "title")
+            ]),
+            cls="m-4",
+        ),
+        Div(
+            *_render_chunk(doc_id, q, source, spans, 0),
+            cls="m-4 p-4 bg-white rounded-lg whitespace-pre-wrap",
+        ),
+    )
+
+def document_chunk(doc_id: str, offset: int, q: str = ""):
+    """Next chunk of the full text, requested when the end of the previous chunk is revealed"""
+    try:
+        document = _load_document(doc_id, q)
+    except search_backend.SearchUnavailableError as e:
+        return P(str(e))
+    if document is None:
+        return None
+    source, spans = document
+    return _render_chunk(doc_id, q, source, spans, max(offset, 0))
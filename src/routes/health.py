@@ -0,0 +1,20 @@
+import os
+from fasthtml.common import JSONResponse
+import database
+import search_backend
+
+def health():
+    """Circuit breaker state of the search backend and usage of the stale result cache"""
+    return search_backend.health()
+
+def healthz():
+    """Liveness: the app process is up and serving requests, elasticsearch is not checked"""
+    return {"status": "ok"}
+
+def readyz():
+    """Readiness: elasticsearch is reachable and the search index exists"""
+    ready, reason = database.check_ready(os.environ["ELASTICSEARCH_INDEX"])
+    return JSONResponse(
+        {"status": "ready" if ready else "not ready", "reason": reason},
+        status_code=200 if ready else 503,
+    )
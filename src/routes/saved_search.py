@@ -0,0 +1,162 @@
+"""Saved searches, stored as percolator queries.
+
+The ingestion pipeline percolates new documents against the saved searches in bulk
+(see `percolate_new_documents` in create_fake_data.py), so each saved search collects
+its new matches without running the search again.
+"""
+import os
+import time
+from dataclasses import asdict
+from fasthtml.common import *
+from elasticsearch import ApiError, TransportError
+import search_backend
+from dataclass.article import ArticleSearchQuery, ArticleRow
+from routes.search_article import (
+    ARTICLE_TABLE_HEAD,
+    ARTICLE_TABLE_CLS,
+    HIGHLIGHT_SETTINGS,
+    _build_elastic_search_query,
+)
+
+# Must match SAVED_SEARCH_INDEX_NAME of the ingestion pipeline
+SAVED_SEARCH_INDEX = f"{os.environ['ELASTICSEARCH_INDEX']}_saved_searches"
+_index_ready = False
+
+# The count also includes the matches beyond the ids kept by the ingestion pipeline,
+# the count read is subtracted so that matches appended after it stay new
+MARK_SEEN_SCRIPT = """
+    ctx._source.saved_new_match_ids.removeAll(params.ids);
+    ctx._source.saved_new_match_count = Math.max(0, ctx._source.saved_new_match_count - params.count);
+"""
+
+def _ensure_saved_search_index():
+    """Create the saved search index on first use. A percolator index needs the mapping
+    of the fields its queries use, so the article index mapping is copied
+
+    Raises:
+        SearchUnavailableError: the circuit breaker is open
+    """
+    global _index_ready
+    if _index_ready:
+        return
+    if search_backend.call(lambda es: es.indices.exists(index=SAVED_SEARCH_INDEX).body):
+        _index_ready = True
+        return
+    article_mapping = search_backend.call(lambda es: es.indices.get_mapping(index=os.environ["ELASTICSEARCH_INDEX"]).body)
+    properties = dict(next(iter(article_mapping.values()))["mappings"]["properties"])
+    properties.update({
+        "query": {"type": "percolator"},
+        "saved_query": {"type": "object", "enabled": False}, # the form values, to display the saved search
+        "saved_at": {"type": "date"},
+        "saved_new_match_ids": {"type": "keyword", "index": False},
+        "saved_new_match_count": {"type": "integer"},
+    })
+    try:
+        search_backend.call(lambda es: es.indices.create(index=SAVED_SEARCH_INDEX, mappings={"properties": properties}))
+    except ApiError as e:
+        if e.error != "resource_already_exists_exception": # created by another worker in between
+            raise
+    _index_ready = True
+
+def _saved_search_card(saved_id: str, saved: dict):
+    new_match_count = saved["saved_new_match_count"]
+    return Div(
+        ArticleSearchQuery(**saved["saved_query"]),
+        Button(
+            f"{new_match_count} new",
+            hx_post=f"/saved-searches/{saved_id}/new-matches",
+            hx_target="#search_result_table",
+            hx_swap="innerHTML",
+            disabled=new_match_count == 0,
+            cls="mt-2 px-2 rounded-full text-white " + ("bg-red-500" if new_match_count else "bg-gray-400"),
+        ),
+        cls=[
+            "min-w-56",
+            "p-4",
+            "border-4",
+            "rounded-lg",
+            "bg-green-300",
+            "items-center",
+            "content-center",
+        ],
+    )
+
+def saved_searches_panel():
+    """Saved searches with their number of new matches, shown in the search history panel"""
+    try:
+        _ensure_saved_search_index()
+        response = search_backend.call(lambda es: es.search(
+            index=SAVED_SEARCH_INDEX,
+            query={"match_all": {}},
+            source_excludes=["query", "saved_new_match_ids"],
+            sort=[{"saved_at": {"order": "desc"}}],
+            size=100,
+        ).body)
+    except (ApiError, TransportError, search_backend.SearchUnavailableError):
+        return Div(id="saved-searches", cls="flex flex-row")
+    return Div(
+        *[_saved_search_card(hit["_id"], hit["_source"]) for hit in response["hits"]["hits"]],
+        id="saved-searches",
+        cls="flex flex-row",
+    )
+
+def save_search(article_search_query: ArticleSearchQuery):
+    """Store the query as a percolator query, compiled the same way as a search"""
+    if not article_search_query.non_empty():
+        return saved_searches_panel()
+    try:
+        compiled_query = _build_elastic_search_query(article_search_query)
+    except ValueError:
+        return saved_searches_panel()
+    try:
+        _ensure_saved_search_index()
+        search_backend.call(lambda es: es.index(
+            index=SAVED_SEARCH_INDEX,
+            document={
+                "query": {"bool": {"must": compiled_query}},
+                "saved_query": asdict(article_search_query),
+                "saved_at": int(time.time()*1000),
+                "saved_new_match_ids": [],
+                "saved_new_match_count": 0,
+            },
+            refresh="wait_for",
+        ))
+    except (ApiError, TransportError, search_backend.SearchUnavailableError) as e:
+        return Div(P(f"Unable to save the search: {type(e).__name__}"), id="saved-searches")
+    return saved_searches_panel()
+
+def show_new_matches(saved_id: str):
+    """Display the new matches of a saved search and mark them as seen"""
+    try:
+        saved = search_backend.call(lambda es: es.get(
+            index=SAVED_SEARCH_INDEX,
+            id=saved_id,
+            source_includes=["saved_new_match_ids", "saved_new_match_count"],
+        ).body)
+        new_match_ids = saved["_source"]["saved_new_match_ids"]
+        search_result = search_backend.search(
+            os.environ["ELASTICSEARCH_INDEX"],
+            {
+                "query": {"terms": {"id": new_match_ids}},
+                "_source": {"excludes": ["*_simplified", "full_text"]},
+                "size": len(new_match_ids),
+                "sort": {"publish_date": {"order": "desc"}},
+            },
+        )
+        # the ingestion pipeline may append matches in the meantime, only the ones read are marked as seen
+        search_backend.call(lambda es: es.update(
+            index=SAVED_SEARCH_INDEX,
+            id=saved_id,
+            script={"source": MARK_SEEN_SCRIPT, "params": {"ids": new_match_ids, "count": saved["_source"]["saved_new_match_count"]}},
+            retry_on_conflict=3,
+            refresh="wait_for",
+        ))
+    except (ApiError, TransportError, search_backend.SearchUnavailableError) as e:
+        return P(f"Unable to load the new matches: {e}")
+    return Table(
+        ARTICLE_TABLE_HEAD,
+        Tbody(
+            *(ArticleRow.from_elastic_search_response(doc, HIGHLIGHT_SETTINGS) for doc in search_result.response["hits"]["hits"]),
+        ),
+        cls=ARTICLE_TABLE_CLS,
+    ), saved_searches_panel()(hx_swap_oob="true")
@@ -1,18 +1,28 @@
 from typing import Literal
 from fasthtml.common import *
-from layout import base_layout
-from database import es
+from elasticsearch import ApiError, TransportError
+from layout import APP_TITLE, base_layout
+import profiling
+import query_compiler
+import search_backend
+import static_assets
 from dataclass.article import (
     TEXT_FIELDS,
     TEXT_FIELD_INVALID_MSG,
     DATE_FIELD_INVALID_MSG,
+    FACET_FIELDS,
     ArticleSearchQuery,
     ArticleRow,
+    FacetFilters,
     HighlightSettings,
 )
+from dataclasses import asdict
 from functools import partial
+import cache
 import chinese_converter
+import json
 import re
+import time
 
 # Special string used in elasticsearch highlight
 # used to split the highlighted simplified text and
@@ -27,6 +37,16 @@ HIGHLIGHT_SETTINGS = HighlightSettings(
 
 PER_PAGE_OPTIONS = [10, 20, 50]
 
+# Show one row per group of near duplicate reprints, only if the index maps the cluster_key field set by the ingestion
+COLLAPSE_NEAR_DUPLICATES = os.environ.get("COLLAPSE_NEAR_DUPLICATES", "TRUE").upper() == "TRUE"
+_cluster_key_mapped: bool|None = None
+
+# Number of buckets shown for each facet
+FACET_SIZE = 10
+# Facet counts do not change when the page changes, they are cached per query and facet filters
+FACET_CACHE_TTL_SECONDS = 300
+facet_cache = cache.create_cache("facets", 256)
+
 BTN_ACTIVATED_CLS = "bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded"
 BTN_DEACTIVATED_CLS = "bg-blue-200 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded"
 
@@ -40,6 +60,9 @@ FORM_SUBMISSION_HTMX_KW = dict(
 
 DEFAULT_DISPLAY_ROWS: int = 10
 
+# Stream the result table row by row instead of building the whole page before sending it
+STREAM_SEARCH_RESULTS = os.environ.get("STREAM_SEARCH_RESULTS", "TRUE").upper() == "TRUE"
+
 PAGINATION_SETTING_JS = """
     let perPage = 10;
     let pageNum = 0;
@@ -68,20 +91,18 @@ PAGINATION_SETTING_JS = """
         $("#search_result_table").submit();
     })
 
-    /* custom validate function for text input fields */
-    customValidate = function(query) {
-        const CONSECUTIVE_AND_OR = /([&|]{2,})|^[&|]|[&|]$/;
-        isValid = !CONSECUTIVE_AND_OR.test(query);
-        return isValid;
+    /* Narrow the results with a facet value, an empty value removes the facet filter */
+    applyFacet = function(button) {
+        $("#" + button.dataset.facet).val(button.dataset.value);
+        pageNum = 0;
+        shouldAddSearchHistory = false;
+        htmx.trigger("#article_search_form", "submit");
     }
+
     $("[id^=text-input-]").on("input", function(event) {
-        if (!customValidate(this.value)) {
-            this.setCustomValidity("no consecutive '&', '|'"); // This is the message display as the field error popup
-        } else {
-            this.setCustomValidity("");
-        }
+        this.setCustomValidity(validateQuery(this.value)); // This is the message display as the field error popup
     });
-"""
+""" + query_compiler.VALIDATE_QUERY_JS
 
 SearchLabel = partial(Label, cls=[
     # "block",
@@ -115,6 +136,18 @@ SearchInput = partial(Input, cls=[
 ])
 SearchInvalidMessage = partial(P, cls="w-64 text-nowrap invisible peer-invalid:visible text-red-600 text-sm")
 
+def _suggestion_kw(name: str)->dict:
+    """Debounced type-ahead suggestions from /suggest, shown in the datalist `suggestions-{name}`"""
+    return dict(
+        list=f"suggestions-{name}",
+        autocomplete="off",
+        hx_get=f"/suggest/{name}",
+        hx_trigger="input changed delay:150ms",
+        hx_target=f"#suggestions-{name}",
+        hx_swap="innerHTML",
+        hx_sync="this:replace", # drop the previous suggestion request when the user keeps typing
+    )
+
 article_search_form = Form(
     id="article_search_form",
     **FORM_SUBMISSION_HTMX_KW,
@@ -122,7 +155,8 @@ article_search_form = Form(
     Fieldset(
         Div(
             SearchLabel("Publisher",
-                SearchInput(type="text", name="publisher", id="text-input-publisher"),
+                SearchInput(type="text", name="publisher", id="text-input-publisher", **_suggestion_kw("publisher")),
+                Datalist(id="suggestions-publisher"),
                 SearchInvalidMessage(TEXT_FIELD_INVALID_MSG)
             ),
             SearchLabel("Publish Location",
@@ -139,11 +173,13 @@ article_search_form = Form(
         ),
         Div(
             SearchLabel("Author Name",
-                SearchInput(type="text", name="author_name", id="text-input-author_name"),
+                SearchInput(type="text", name="author_name", id="text-input-author_name", **_suggestion_kw("author_name")),
+                Datalist(id="suggestions-author_name"),
                 SearchInvalidMessage(TEXT_FIELD_INVALID_MSG)
             ),
             SearchLabel("Title",
-                SearchInput(type="text", name="title", id="text-input-title"),
+                SearchInput(type="text", name="title", id="text-input-title", **_suggestion_kw("title")),
+                Datalist(id="suggestions-title"),
                 SearchInvalidMessage(TEXT_FIELD_INVALID_MSG)
             ),
             SearchLabel("Full Text",
@@ -184,8 +220,9 @@ article_search_form = Form(
                 # "flex",
             ]
         ),
+        *[Input(type="hidden", name=f"facet_{name}", id=f"facet_{name}") for name in FACET_FIELDS + ["publish_date"]],
         Button("Search", type="submit",
-            onclick="pageNum=0;shouldAddSearchHistory = true;",
+            onclick="pageNum=0;shouldAddSearchHistory = true;$('[id^=facet_]').val('');",
             cls="bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded",
         ),
         cls="flex justify-between"
@@ -201,13 +238,13 @@ article_search_form = Form(
 )
 
 # handles get request
-def article_search_page():
+def _article_search_page_body():
     return base_layout(
         Div(
             Details(
                 Summary("How to search"),
                 Ul(
-                    Li("User can use '|' (OR) and '&' (AND) to create complex query."),
+                    Li("User can use '|' (OR), '&' (AND) and brackets to create complex query, e.g. (中国|香港)&北京. '&' is applied before '|'."),
                     Li(
                         "These formats are accepted in publish_date field:",
                         Ol(
@@ -236,7 +273,9 @@ def article_search_page():
         Div(
             H2("Search history"),
             Div(
-                id="search-history",
+                # saved searches with their number of new matches, followed by the searches of this session
+                Div(id="saved-searches", hx_get="/saved-searches", hx_trigger="load", hx_swap="outerHTML"),
+                Div(id="search-history", cls="flex flex-row"),
                 cls=[
                     "h-48",
                     "flex",
@@ -247,6 +286,7 @@ def article_search_page():
                 ]
             )
         ),
+        Div(id="search-facets"),
         Div(id="search_result_table",
             cls=[
                 "w-full",
@@ -265,32 +305,16 @@ def article_search_page():
         )
     )
 
-def _parse_query(query: str, target_field: str):
-    """Parse user input query (containing `&`, `|`) to elasticsearch query
-
-    Args:
-        query (str): User input query containing keywords
-    """
-
-    query = query.replace(" ", "")
-    or_queries = query.split("|")
-    and_queries = [subquery.split("&") for subquery in or_queries]
-
-    es_query = {"bool": {"should": []}}
-
-    for and_query in and_queries:
-        if len(and_query) == 1:
-            q = {"match_phrase": {target_field: and_query[0]}}
-        else:
-            q = {
-                "bool": {
-                    "must": [
-                        {"match_phrase": {target_field: item}} for item in and_query
-                    ]
-                }
-            }
-        es_query["bool"]["should"].append(q)
-    return es_query
+# The search page does not depend on the request, it is rendered and compressed on the first visit only
+_page_shell: static_assets.PrecompressedContent|None = None
+
+def article_search_page(req):
+    """Search page shell, revalidated by ETag so repeat visits get a 304 Not Modified"""
+    global _page_shell
+    if _page_shell is None:
+        page = Html(Head(Title(APP_TITLE), *static_assets.page_headers()), _article_search_page_body())
+        _page_shell = static_assets.PrecompressedContent.from_bytes(to_xml(page).encode(), "text/html; charset=utf-8")
+    return _page_shell.response(req, "no-cache")
 
 def _build_elastic_search_query(query: ArticleSearchQuery)->list[dict[str, dict[str, str|dict[str, str]]]]:
     errors = query.get_errors()
@@ -304,8 +328,8 @@ def _build_elastic_search_query(query: ArticleSearchQuery)->list[dict[str, dict[
         compound_queries.append(es_query)
 
     for name in TEXT_FIELDS:
-        if value:=getattr(query, name):
-            es_query = _parse_query(chinese_converter.t2s.convert(value), f"{name}_simplified")
+        if value:=getattr(query, name).strip():
+            es_query = query_compiler.compile_query(chinese_converter.t2s(value), f"{name}_simplified")
             compound_queries.append(es_query)
     return compound_queries
 
@@ -332,9 +356,123 @@ ARTICLE_TABLE_CLS = cls=[
         "text-l",
     ]
 
+def _stale_result_notice(search_result: search_backend.SearchResult):
+    """Warn the user when the results are served from cache while elasticsearch is unavailable"""
+    if not search_result.stale:
+        return None
+    cached_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(search_result.cached_at))
+    return P(
+        f"Search service is degraded, showing results cached at {cached_at}, they may be out of date",
+        cls="w-11/12 p-2 bg-yellow-200 text-yellow-900 rounded",
+    )
+
+def _stream_search_result(search_result: search_backend.SearchResult, pagination, queried_documents: list[dict], full_text_query: str, oob_elements: list):
+    """Serialize the result table piece by piece, the header and pagination are sent before any row is highlighted,
+    then each row is highlighted, rendered and flushed on its own, so only one row is held in memory at a time"""
+    yield "".join([
+        "<div>",
+        to_xml(_stale_result_notice(search_result)) if search_result.stale else "",
+        to_xml(pagination),
+        f'<table class="{" ".join(ARTICLE_TABLE_CLS)}">',
+        to_xml(ARTICLE_TABLE_HEAD),
+        "<tbody>",
+    ])
+    for doc in queried_documents:
+        yield to_xml(ArticleRow.from_elastic_search_response(doc, HIGHLIGHT_SETTINGS, full_text_query))
+    yield "".join([
+        "</tbody></table>",
+        to_xml(pagination),
+        "</div>",
+        *(to_xml(element) for element in oob_elements if element is not None),
+    ])
+
+def _collapse_near_duplicates()->bool:
+    """Indices loaded before the reprint clustering have no cluster_key, elasticsearch rejects collapsing on it.
+    The mapping is checked on first use, through the circuit breaker so it never waits on an unavailable elasticsearch"""
+    global _cluster_key_mapped
+    if not COLLAPSE_NEAR_DUPLICATES:
+        return False
+    if _cluster_key_mapped is None:
+        try:
+            field_mapping = search_backend.call(
+                lambda es: es.indices.get_field_mapping(index=os.environ["ELASTICSEARCH_INDEX"], fields="cluster_key").body
+            )
+        except (ApiError, TransportError, search_backend.SearchUnavailableError):
+            # checked again on a later search, the request body stays the same as the cached results meanwhile
+            return True
+        _cluster_key_mapped = any(index_mapping["mappings"] for index_mapping in field_mapping.values())
+        if not _cluster_key_mapped:
+            print("cluster_key is not mapped in the index, near duplicate reprints are not collapsed")
+    return _cluster_key_mapped
+
+def _facet_aggregations(facet_filters: FacetFilters)->dict:
+    """Facet counts computed in the same request as the hits.
+    The publish date histogram is yearly, or monthly once a year or a month is selected"""
+    aggregations = {
+        name: {"terms": {"field": f"{name}.keyword", "size": FACET_SIZE}}
+        for name in FACET_FIELDS
+    }
+    monthly = bool(facet_filters.facet_publish_date)
+    aggregations["publish_date"] = {"date_histogram": {
+        "field": "publish_date",
+        "calendar_interval": "month" if monthly else "year",
+        "format": "yyyy-MM" if monthly else "yyyy",
+        "min_doc_count": 1,
+        "order": {"_key": "desc"},
+    }}
+    return aggregations
+
+def _facet_button(name: str, value: str, doc_count: int, active_value: str):
+    """Clicking a value adds it as a filter, clicking the active value removes it"""
+    is_active = value == active_value
+    return Button(
+        f"{value} ({doc_count})",
+        type="button",
+        onclick="applyFacet(this)",
+        data_facet=f"facet_{name}",
+        data_value="" if is_active else value,
+        cls="block text-left text-sm hover:underline" + (" font-bold text-blue-600" if is_active else ""),
+    )
+
+def _facet_clear_button(name: str, active_value: str):
+    """Remove the active value, a selected month goes back to its year.
+    The active value is not always a bucket, e.g. a year while the histogram is monthly"""
+    if not active_value:
+        return None
+    parent_value = active_value[:4] if name == "publish_date" and len(active_value) == 7 else ""
+    return Button(
+        f"✕ {active_value}",
+        type="button",
+        onclick="applyFacet(this)",
+        data_facet=f"facet_{name}",
+        data_value=parent_value,
+        cls="block text-left text-sm hover:underline font-bold text-blue-600",
+    )
+
+def _facet_panel(aggregations: dict|None, facet_filters: FacetFilters):
+    if aggregations is None:
+        return Div(id="search-facets", hx_swap_oob="true")
+    return Div(
+        *[Div(
+            P(name.replace("_", " ").title(), cls="font-bold"),
+            _facet_clear_button(name, getattr(facet_filters, f"facet_{name}")),
+            *[_facet_button(
+                name,
+                bucket.get("key_as_string", bucket["key"]), # date histogram keys are timestamps
+                bucket["doc_count"],
+                getattr(facet_filters, f"facet_{name}"),
+            ) for bucket in aggregations[name]["buckets"]],
+            cls="p-2 min-w-48",
+        ) for name in FACET_FIELDS + ["publish_date"]],
+        id="search-facets",
+        hx_swap_oob="true",
+        cls="flex flex-row border-4 rounded-lg bg-indigo-50 max-h-64 overflow-y-auto",
+    )
+
 # handles post request
 def search_article(
     article_search_query: ArticleSearchQuery,
+    facet_filters: FacetFilters,
     per_page: int,
     page_id: int,
     add_search_history: bool = False,
@@ -347,10 +485,13 @@ def search_article(
         return Table(ARTICLE_TABLE_HEAD, cls=ARTICLE_TABLE_CLS)
     try:
         search_query = _build_elastic_search_query(article_search_query)
+        if facet_errors := facet_filters.get_errors():
+            raise ValueError(facet_errors)
     except ValueError as e:
         #TODO: display error in form and remove content in table
+        errors = e.args[0]
         return Div(
-            P(str(e)),
+            *[P(f"{name.replace('_', ' ').title()}: {message}") for name, message in errors.items()],
             cls=[
                 "flex",
                 "w-full",
@@ -361,10 +502,16 @@ def search_article(
     # Avoid hacker
     per_page = max(per_page, 1)
     page_id = max(page_id, 0)
+    es_filters = facet_filters.to_elastic_search_filters()
+    facet_cache_key = json.dumps([search_query, es_filters], sort_keys=True, ensure_ascii=False)
+    cached_facets = facet_cache.get(facet_cache_key)
+    if cached_facets is not None and time.time() - cached_facets[1] > FACET_CACHE_TTL_SECONDS:
+        cached_facets = None
     es_search_body = {
         "query": {
             "bool": {
                 "must": search_query,
+                "filter": es_filters,
             },
         },
         "highlight" : {
@@ -381,19 +528,57 @@ def search_article(
                 "full_text_simplified": {},
             }
         },
+        # The simplified fields are only used for searching, and the full text is only needed to highlight
+        # the full text keywords, otherwise it is read in the document viewer
+        "_source": {"excludes": ["*_simplified"] + ([] if article_search_query.full_text else ["full_text"])},
         "size": per_page,
         "from": page_id*per_page,
         "sort": {"publish_date": {"order": "desc"}},
     }
+    aggs = {}
+    collapse_near_duplicates = _collapse_near_duplicates()
+    if collapse_near_duplicates:
+        # one row per group of reprints, the number of documents in the group is in inner_hits
+        es_search_body["collapse"] = {"field": "cluster_key", "inner_hits": {"name": "reprints", "size": 0}}
+        aggs["clusters"] = {"cardinality": {"field": "cluster_key"}} # number of rows, for the pagination
+    if aggs:
+        es_search_body["aggs"] = aggs
+    # the facet aggregations depend on the facet cache, they are not part of the stale result cache key
+    cache_key_body = dict(es_search_body)
+    if cached_facets is None: # otherwise skip the aggregations, e.g. when only the page changes
+        es_search_body["aggs"] = {**aggs, **_facet_aggregations(facet_filters)}
 
-    response = es.search(
-        index=os.environ["ELASTICSEARCH_INDEX"],
-        body=es_search_body,
-    )
+    try:
+        search_result = search_backend.search(os.environ["ELASTICSEARCH_INDEX"], es_search_body, cache_key_body=cache_key_body)
+    except search_backend.SearchUnavailableError as e:
+        return Div(
+            P(str(e)),
+            cls=[
+                "flex",
+                "w-full",
+                "justify-self-start",
+                "border-8",
+            ]
+        )
+    response = search_result.response
+    if cached_facets is not None:
+        aggregations = cached_facets[0]
+    elif all(name in response.get("aggregations", {}) for name in FACET_FIELDS + ["publish_date"]):
+        # a stale response may come from a request without the facet aggregations
+        aggregations = {name: response["aggregations"][name] for name in FACET_FIELDS + ["publish_date"]}
+        if not search_result.stale:
+            facet_cache.set(facet_cache_key, aggregations)
+    else:
+        aggregations = None
 
     queried_documents: list[dict[Literal["_source", "highlight"], Any]] = response["hits"]["hits"]
+    full_text_query = article_search_query.full_text
 
-    total_pages = math.ceil(response['hits']['total']['value'] / per_page)
+    if collapse_near_duplicates:
+        total_rows = response["aggregations"]["clusters"]["value"]
+    else:
+        total_rows = response['hits']['total']['value']
+    total_pages = math.ceil(total_rows / per_page)
     curr_page = page_id + 1
     prev_page_btn = None if curr_page==1 else Button(
         "Previous", type="submit", id=f"page_{page_id-1}",
@@ -420,19 +605,17 @@ def search_article(
         ]
     )
 
-    return Div(
-        pagination,
-        Table(
-            ARTICLE_TABLE_HEAD,
-            Tbody(
-                *(ArticleRow.from_elastic_search_response(doc, HIGHLIGHT_SETTINGS) for doc in queried_documents),
-            ),
-            cls=ARTICLE_TABLE_CLS,
-        ),
-        pagination,
-    ), Div( # Only add search history if it is trigger by the "Submit" button (new search)
+    search_history = Div( # Only add search history if it is trigger by the "Submit" button (new search)
         Div(
             article_search_query,
+            Button(
+                "Save",
+                hx_post="/saved-searches",
+                hx_vals=json.dumps(asdict(article_search_query), ensure_ascii=False),
+                hx_target="#saved-searches",
+                hx_swap="outerHTML",
+                cls="mt-2 px-2 rounded bg-blue-500 hover:bg-blue-700 text-white",
+            ),
             cls=[
                 "min-w-56",
                 "p-4",
@@ -447,3 +630,26 @@ def search_article(
         ),
         hx_swap_oob="afterbegin:#search-history",
     ) if add_search_history else None
+
+    facet_panel = _facet_panel(aggregations, facet_filters)
+
+    if STREAM_SEARCH_RESULTS:
+        return StreamingResponse(
+            profiling.profile_iterator(
+                _stream_search_result(search_result, pagination, queried_documents, full_text_query, [search_history, facet_panel]),
+            ),
+            media_type="text/html",
+        )
+
+    return Div(
+        _stale_result_notice(search_result),
+        pagination,
+        Table(
+            ARTICLE_TABLE_HEAD,
+            Tbody(
+                *(ArticleRow.from_elastic_search_response(doc, HIGHLIGHT_SETTINGS, full_text_query) for doc in queried_documents),
+            ),
+            cls=ARTICLE_TABLE_CLS,
+        ),
+        pagination,
+    ), search_history, facet_panel
@@ -0,0 +1,62 @@
+import os
+import re
+import time
+from fasthtml.common import *
+from elasticsearch import ApiError
+import cache
+import chinese_converter
+import search_backend
+
+SUGGEST_FIELDS = ["publisher", "author_name", "title"]
+SUGGESTION_SIZE = 8
+# Hot prefixes are answered from memory, users typing the same names hit the same prefixes
+SUGGESTION_CACHE_TTL_SECONDS = 60
+suggestion_cache = cache.LocalCache("suggestions", 2048)
+
+def _last_term(value: str)->tuple[str, str]:
+    """Split the query into the part before the term being typed and the term itself,
+    e.g. "中国&北" -> ("中国&", "北")"""
+    head, term = re.match(r"(.*[&|()]\s*)?(.*)", value).groups()
+    return head or "", term.strip()
+
+def _fetch_suggestions(field: str, prefix: str)->list[str]:
+    """Original (not simplified) values whose simplified version starts with `prefix`"""
+    cache_key = f"{field}\n{prefix}"
+    cached = suggestion_cache.get(cache_key)
+    if cached is not None and time.time() - cached[1] < SUGGESTION_CACHE_TTL_SECONDS:
+        return cached[0]
+    search_result = search_backend.search(
+        os.environ["ELASTICSEARCH_INDEX"],
+        {
+            "_source": [field],
+            "suggest": {
+                "suggestions": {
+                    "prefix": prefix,
+                    "completion": {
+                        "field": f"{field}_simplified.suggest",
+                        "size": SUGGESTION_SIZE,
+                        "skip_duplicates": True,
+                    },
+                },
+            },
+        },
+        stale_fallback=False,
+    )
+    suggestions = [option["_source"][field] for option in search_result.response["suggest"]["suggestions"][0]["options"]]
+    suggestion_cache.set(cache_key, suggestions)
+    return suggestions
+
+def suggest(field: str, req):
+    """Options of the input datalist, the input sends its own value named after the field"""
+    if field not in SUGGEST_FIELDS:
+        return None
+    head, term = _last_term(req.query_params.get(field, ""))
+    if not term:
+        return None
+    try:
+        suggestions = _fetch_suggestions(field, chinese_converter.t2s(term))
+    except search_backend.SearchUnavailableError:
+        return None
+    except ApiError: # e.g. an index created before the suggest sub-fields, see the readme
+        return None
+    return tuple(Option(value=f"{head}{suggestion}") for suggestion in suggestions)
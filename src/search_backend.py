@@ -0,0 +1,174 @@
+"""Guarded access to elasticsearch search.
+
+All searches go through `search`, which
+1. rejects calls while the circuit breaker is open (elasticsearch slow or down)
+2. keeps the most recent responses in the result cache (shared by workers, see `cache`)
+3. serves the cached response marked as stale when elasticsearch cannot answer,
+   and refreshes it in the background once elasticsearch recovers
+"""
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, TypeVar
+from elasticsearch import ApiError, Elasticsearch, TransportError
+from circuit_breaker import CircuitBreaker, CircuitBreakerSettings
+import cache
+import database
+
+STALE_CACHE_SIZE = int(os.environ.get("STALE_CACHE_SIZE", 512))
+REFRESH_POLL_SECONDS = 1.0
+UNAVAILABLE_MSG = "Search service is temporarily unavailable, please try again later"
+T = TypeVar("T")
+
+breaker = CircuitBreaker(CircuitBreakerSettings(
+    slow_call_seconds=float(os.environ.get("SEARCH_SLOW_CALL_SECONDS", 2.0)),
+    open_seconds=float(os.environ.get("SEARCH_BREAKER_OPEN_SECONDS", 30.0)),
+))
+
+class SearchUnavailableError(Exception):
+    """Elasticsearch cannot answer and there is no cached response to fall back to"""
+
+@dataclass
+class SearchResult:
+    """
+    response (dict):
+        Elasticsearch search response body
+    stale (bool):
+        True if the response is served from the local cache because elasticsearch is unavailable
+    cached_at (float | None):
+        Unix timestamp of when a stale response was fetched from elasticsearch
+    """
+    response: dict
+    stale: bool = False
+    cached_at: float|None = None
+
+result_cache = cache.create_cache("search_results", STALE_CACHE_SIZE)
+
+def _cache_key(index: str, body: dict)->str:
+    return json.dumps([index, body], sort_keys=True, ensure_ascii=False)
+
+def _is_backend_failure(error: Exception)->bool:
+    """Connection errors, timeouts and 5xx count against the breaker, bad queries (4xx) do not"""
+    if isinstance(error, ApiError):
+        return error.meta.status >= 500 or error.meta.status == 429
+    return isinstance(error, TransportError)
+
+def _record_call(operation: Callable[[Elasticsearch], T])->T:
+    """Run `operation` with the elasticsearch client and record its outcome in the breaker"""
+    start = time.perf_counter()
+    try:
+        result = operation(database.get_es())
+    except (ApiError, TransportError) as e:
+        if _is_backend_failure(e):
+            breaker.record_failure(f"{type(e).__name__}: {e}")
+        else:
+            breaker.record_success(time.perf_counter() - start)
+        raise
+    breaker.record_success(time.perf_counter() - start)
+    return result
+
+def _call_elasticsearch(index: str, body: dict)->dict:
+    return _record_call(lambda es: es.search(index=index, body=body).body)
+
+def call(operation: Callable[[Elasticsearch], T])->T:
+    """Run a non-search elasticsearch call (mapping, index, update...) through the circuit breaker,
+    without result cache
+
+    Raises:
+        SearchUnavailableError: the breaker is open, elasticsearch is not called
+        ApiError, TransportError: the call failed
+    """
+    if not breaker.allow_request():
+        raise SearchUnavailableError(UNAVAILABLE_MSG)
+    return _record_call(operation)
+
+_refresh_queue: queue.Queue[tuple[str, str, dict]] = queue.Queue()
+_pending_refresh: set[str] = set()
+_pending_lock = threading.Lock()
+_refresh_thread: threading.Thread|None = None
+
+def _schedule_refresh(key: str, index: str, body: dict):
+    global _refresh_thread
+    with _pending_lock:
+        if key in _pending_refresh:
+            return
+        _pending_refresh.add(key)
+        if _refresh_thread is None: # started on first use to keep import cheap
+            _refresh_thread = threading.Thread(target=_refresh_worker, name="stale-result-refresher", daemon=True)
+            _refresh_thread.start()
+    _refresh_queue.put((key, index, body))
+
+def _refresh_worker():
+    """Re-run searches whose stale responses were served, once the breaker lets calls through again"""
+    while True:
+        key, index, body = _refresh_queue.get()
+        while not breaker.allow_request():
+            time.sleep(REFRESH_POLL_SECONDS)
+        try:
+            result_cache.set(key, _call_elasticsearch(index, body))
+        except (ApiError, TransportError) as e:
+            if _is_backend_failure(e): # still down, try again later
+                _refresh_queue.put((key, index, body))
+                time.sleep(REFRESH_POLL_SECONDS)
+                continue
+        with _pending_lock:
+            _pending_refresh.discard(key)
+
+def reset_after_fork():
+    """Forget the refresh thread of the parent process, threads do not survive a fork"""
+    global _refresh_queue, _pending_refresh, _pending_lock, _refresh_thread
+    _refresh_queue = queue.Queue()
+    _pending_refresh = set()
+    _pending_lock = threading.Lock()
+    _refresh_thread = None
+
+def search(index: str, body: dict, stale_fallback: bool = True, cache_key_body: dict|None = None)->SearchResult:
+    """Search elasticsearch through the circuit breaker, falling back to the stale result cache
+
+    Args:
+        stale_fallback (bool):
+            Keep the response for the stale result cache, disable for cheap and short-lived requests
+            (e.g. suggestions) so they do not evict search results from the cache
+        cache_key_body (dict | None):
+            Body identifying the response in the stale result cache, defaults to `body`.
+            Leave out optional parts of the body (e.g. aggregations cached elsewhere) so that
+            requests with and without them share one cached response
+
+    Raises:
+        SearchUnavailableError: elasticsearch is unavailable and the query has never been answered before
+        ApiError: elasticsearch rejected the query itself (e.g. malformed query)
+    """
+    key = _cache_key(index, body if cache_key_body is None else cache_key_body)
+    if breaker.allow_request():
+        try:
+            response = _call_elasticsearch(index, body)
+        except (ApiError, TransportError) as e:
+            if not _is_backend_failure(e):
+                raise
+        else:
+            if stale_fallback:
+                result_cache.set(key, response)
+            return SearchResult(response)
+
+    if not stale_fallback:
+        raise SearchUnavailableError(UNAVAILABLE_MSG)
+    cached = result_cache.get(key)
+    if cached is None:
+        raise SearchUnavailableError(UNAVAILABLE_MSG)
+    _schedule_refresh(key, index, body)
+    response, cached_at = cached
+    return SearchResult(response, stale=True, cached_at=cached_at)
+
+def health()->dict:
+    """Breaker state and cache usage, exposed by the health endpoint"""
+    return {
+        "search_backend": breaker.snapshot(),
+        "stale_cache": {
+            "size": len(result_cache),
+            "maxsize": result_cache.maxsize,
+            "pending_refresh": _refresh_queue.qsize(),
+        },
+    }
@@ -0,0 +1,107 @@
+"""Self-hosted static assets and precompressed responses.
+
+`build_static.py` writes the purged Tailwind CSS and the vendored JS under content-hashed
+filenames in static/dist, with a manifest.json mapping each asset name to its file.
+Without a build (e.g. local development) the assets are loaded from their CDNs.
+"""
+import gzip
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from fasthtml.common import *
+
+try:
+    import brotli
+except ImportError: # optional, gzip only
+    brotli = None
+
+STATIC_DIST_DIR = Path(__file__).resolve().parent.parent / "static" / "dist"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def _load_manifest()->dict[str, str]:
+    manifest_path = STATIC_DIST_DIR / "manifest.json"
+    if not manifest_path.exists():
+        return {}
+    return json.loads(manifest_path.read_text())
+
+manifest = _load_manifest()
+SELF_HOSTED = bool(manifest)
+
+def asset_url(name: str)->str:
+    return f"/static/dist/{manifest[name]}"
+
+def page_headers()->tuple:
+    """Page <head> content, replaces the fasthtml default headers"""
+    if not SELF_HOSTED:
+        return (
+            charset,
+            viewport,
+            htmxsrc,
+            fhjsscr,
+            # JQuery
+            Script(
+                src="https://code.jquery.com/jquery-3.7.1.slim.min.js",
+                integrity="sha256-kmHvs0B+OpCW5GVHUNjv9rOmY0IvSIRcf7zGUDTDQM8=",
+                crossorigin="anonymous"
+            ),
+
+            # Select2
+            Link(rel="stylesheet", href="https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/css/select2.min.css"),
+            Script(src="https://cdn.jsdelivr.net/npm/select2@4.1.0-rc.0/dist/js/select2.min.js"),
+
+            # Tailwind, compiled in the browser
+            Script(src="https://cdn.tailwindcss.com"),
+        )
+    return (
+        charset,
+        viewport,
+        Link(rel="stylesheet", href=asset_url("tailwind.css")),
+        Script(src=asset_url("htmx.js")),
+        Script(src=asset_url("fasthtml.js")),
+        Script(src=asset_url("jquery.js")),
+        Link(rel="stylesheet", href=asset_url("select2.css")),
+        Script(src=asset_url("select2.js")),
+    )
+
+@dataclass
+class PrecompressedContent:
+    """Content compressed once, served with the best encoding the client accepts"""
+    body: bytes
+    media_type: str
+    etag: str
+    gzip_body: bytes
+    brotli_body: bytes|None
+
+    @classmethod
+    def from_bytes(cls, body: bytes, media_type: str):
+        return cls(
+            body=body,
+            media_type=media_type,
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+            brotli_body=brotli.compress(body) if brotli else None,
+        )
+
+    def response(self, req, cache_control: str)->Response:
+        headers = {"ETag": self.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if self.etag in req.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        accept_encoding = req.headers.get("accept-encoding", "")
+        if self.brotli_body is not None and "br" in accept_encoding:
+            return Response(self.brotli_body, media_type=self.media_type, headers={**headers, "Content-Encoding": "br"})
+        if "gzip" in accept_encoding:
+            return Response(self.gzip_body, media_type=self.media_type, headers={**headers, "Content-Encoding": "gzip"})
+        return Response(self.body, media_type=self.media_type, headers=headers)
+
+_MEDIA_TYPES = {".css": "text/css; charset=utf-8", ".js": "text/javascript; charset=utf-8"}
+_loaded_assets: dict[str, PrecompressedContent] = {}
+
+def static_asset(fname: str, req):
+    """Serve a fingerprinted asset, its name changes with its content so it can be cached forever"""
+    if fname not in manifest.values():
+        return Response(status_code=404)
+    if fname not in _loaded_assets:
+        path = STATIC_DIST_DIR / fname
+        _loaded_assets[fname] = PrecompressedContent.from_bytes(path.read_bytes(), _MEDIA_TYPES.get(path.suffix, "application/octet-stream"))
+    return _loaded_assets[fname].response(req, IMMUTABLE_CACHE_CONTROL)
@@ -0,0 +1,70 @@
+"""Multi-worker serving mode.
+
+The app is imported once in the master process (preloaded), then forked into `WORKERS`
+uvicorn workers sharing one listening socket. After the fork every worker opens its own
+elasticsearch connection pool and loads OpenCC once. Set `SHARED_CACHE_PATH` so the
+workers share the result cache (see `cache`).
+"""
+import os
+import signal
+import socket
+import time
+import uvicorn
+import chinese_converter
+import database
+import search_backend
+
+RESPAWN_DELAY_SECONDS = 1.0
+
+def _init_worker():
+    """Runs in each worker right after the fork, before it serves any request"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    database.reset_after_fork()
+    search_backend.reset_after_fork()
+    chinese_converter.t2s("") # load the OpenCC dictionary once in this worker
+
+def _bind_socket(host: str, port: int)->socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def _spawn_worker(app, sock: socket.socket)->int:
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    _init_worker()
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info", timeout_graceful_shutdown=30))
+    server.run(sockets=[sock])
+    os._exit(0)
+
+def serve_workers(app, workers: int, host: str = "0.0.0.0", port: int|None = None):
+    """Serve the preloaded `app` with `workers` forked processes, restarting any worker that dies"""
+    port = port or int(os.getenv("PORT", default=5001))
+    sock = _bind_socket(host, port)
+    print(f"Serving on http://{host}:{port} with {workers} workers")
+
+    stopping = False
+    def _stop(sig, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    children = {_spawn_worker(app, sock) for _ in range(workers)}
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, starting a new one")
+            time.sleep(RESPAWN_DELAY_SECONDS)
+            children.add(_spawn_worker(app, sock))
+    sock.close()
@@ -0,0 +1,9 @@
+/** @type {import('tailwindcss').Config} */
+module.exports = {
+  // class names are written in the python FT components
+  content: ["./src/**/*.py"],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+}
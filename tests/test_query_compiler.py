@@ -0,0 +1,105 @@
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import query_compiler
+from query_compiler import And, Keyword, Or, QuerySyntaxError
+
+def _expression(query: str)->str:
+    return query_compiler.to_expression(query_compiler.parse_query(query))
+
+class ParseTest(unittest.TestCase):
+    def test_and_binds_tighter_than_or(self):
+        self.assertEqual(query_compiler.parse_query("a|b&c"), Or((Keyword("a"), And((Keyword("b"), Keyword("c"))))))
+
+    def test_brackets_override_precedence(self):
+        self.assertEqual(query_compiler.parse_query("(a|b)&c"), And((Or((Keyword("a"), Keyword("b"))), Keyword("c"))))
+        self.assertEqual(_expression("((a))"), "a")
+
+    def test_keywords_keep_inner_whitespace(self):
+        self.assertEqual(query_compiler.parse_query(" 北京 大学 & 中国 "), And((Keyword("中国"), Keyword("北京 大学"))))
+
+    def test_error_positions(self):
+        cases = {
+            "a&&b": ("missing keyword", 2),
+            "((a)": ("unmatched '('", 0),
+            "a)(b": ("unmatched ')'", 1),
+            "(a|)": ("missing keyword", 3),
+            "(a)b": ("missing '&' or '|'", 3),
+            "a&": ("missing keyword", None),
+            "": ("missing keyword", None),
+        }
+        for query, (message, position) in cases.items():
+            with self.subTest(query=query):
+                with self.assertRaises(QuerySyntaxError) as context:
+                    query_compiler.parse_query(query)
+                self.assertEqual(context.exception.position, position)
+                self.assertTrue(str(context.exception).startswith(message))
+
+    def test_validate(self):
+        self.assertIsNone(query_compiler.validate("(中国|香港)&北京"))
+        self.assertEqual(str(query_compiler.validate("a&&b")), "missing keyword at character 3")
+
+class SimplifyTest(unittest.TestCase):
+    def test_absorption(self):
+        self.assertEqual(_expression("中国|中国&北京"), "中国")
+        self.assertEqual(_expression("(a|b)&(a|b|c)"), "a|b")
+        self.assertEqual(_expression("a&(a|b)"), "a")
+
+    def test_dedupe(self):
+        self.assertEqual(_expression("a|a"), "a")
+        self.assertEqual(_expression("b&a|a&b"), "a&b")
+
+    def test_flattening(self):
+        self.assertEqual(query_compiler.parse_query("a&(b&c)"), And((Keyword("a"), Keyword("b"), Keyword("c"))))
+        self.assertEqual(_expression("a|(b|(c|d))"), "a|b|c|d")
+
+    def test_not_absorbed(self):
+        self.assertEqual(_expression("a|b&c"), "a|b&c")
+        self.assertEqual(_expression("(a|b)&c"), "(a|b)&c")
+
+class CompileTest(unittest.TestCase):
+    def test_compile(self):
+        self.assertEqual(query_compiler.compile_query("a", "f"), {"match_phrase": {"f": "a"}})
+        self.assertEqual(
+            query_compiler.compile_query("(a|b)&c", "f"),
+            {"bool": {"must": [
+                {"bool": {"should": [{"match_phrase": {"f": "a"}}, {"match_phrase": {"f": "b"}}], "minimum_should_match": 1}},
+                {"match_phrase": {"f": "c"}},
+            ]}},
+        )
+
+    def test_equivalent_expressions_share_compiled_query(self):
+        query_compiler._compile_simplified.cache_clear()
+        first = query_compiler.compile_query("b&a", "f")
+        second = query_compiler.compile_query("(a)&b|a&b&a", "f")
+        self.assertIs(first, second)
+        cache_info = query_compiler._compile_simplified.cache_info()
+        self.assertEqual((cache_info.misses, cache_info.hits), (1, 1))
+
+    def test_cache_is_per_field(self):
+        self.assertNotEqual(query_compiler.compile_query("a", "f"), query_compiler.compile_query("a", "g"))
+
+@unittest.skipIf(shutil.which("node") is None, "node is not installed")
+class ValidateQueryJsTest(unittest.TestCase):
+    def test_same_messages_as_python(self):
+        random.seed(0)
+        queries = ["", "  ", "a&&b", "((a)", "a)(b", "(a|)", "(a)b", "a(b)", "()", "中国|中国&北京", "(中国|香港)&北京"]
+        queries += ["".join(random.choice("ab &|() ") for _ in range(random.randint(1, 9))) for _ in range(2000)]
+        script = query_compiler.VALIDATE_QUERY_JS + """
+            const queries = JSON.parse(require("fs").readFileSync(0, "utf8"));
+            console.log(JSON.stringify(queries.map(validateQuery)));
+        """
+        output = subprocess.run(["node", "-e", script], input=json.dumps(queries), capture_output=True, text=True, check=True).stdout
+        expected = ["" if not query.strip() else str(query_compiler.validate(query) or "") for query in queries]
+        for query, js_message, python_message in zip(queries, json.loads(output), expected):
+            self.assertEqual(js_message, python_message, query)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+os.environ.setdefault("ELASTICSEARCH_URL", "http://localhost:9200")
+os.environ.setdefault("ELASTICSEARCH_INDEX", "test_articles")
+os.environ.pop("SHARED_CACHE_PATH", None)
+
+from elasticsearch import ConnectionError as ElasticsearchConnectionError
+import search_backend
+from dataclass.article import ArticleSearchQuery, FacetFilters
+from routes import search_article
+
+def _response(body: dict)->dict:
+    aggregations = {"clusters": {"value": 1}}
+    for name in body.get("aggs", {}):
+        aggregations.setdefault(name, {"buckets": [{"key": "value", "key_as_string": "2020", "doc_count": 1}]})
+    hit = {
+        "_source": {
+            "id": "1", "publisher": "p", "publish_location": "l", "publish_date": "2020-01-01",
+            "author_name": "a", "title": "t", "full_text": "中国",
+        },
+        "highlight": {"full_text_simplified": ["~!~中国~!~"]},
+    }
+    return {"hits": {"total": {"value": 1}, "hits": [hit]}, "aggregations": aggregations}
+
+class FakeElasticsearch:
+    def __init__(self):
+        self.available = True
+        self.bodies = []
+
+    def search(self, index: str, body: dict):
+        if not self.available:
+            raise ElasticsearchConnectionError("elasticsearch is down")
+        self.bodies.append(body)
+        return mock.Mock(body=_response(body))
+
+class StaleSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.es = FakeElasticsearch()
+        patches = [
+            mock.patch("database.get_es", return_value=self.es),
+            mock.patch.object(search_backend, "result_cache", search_backend.cache.LocalCache("search_results", 16)),
+            mock.patch.object(search_backend, "_schedule_refresh"),
+            mock.patch.object(search_article, "facet_cache", search_article.cache.LocalCache("facets", 16)),
+            mock.patch.object(search_article, "STREAM_SEARCH_RESULTS", False),
+            mock.patch.object(search_article, "_collapse_near_duplicates", return_value=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        search_backend.breaker._outcomes.clear()
+
+    def _search(self):
+        query = ArticleSearchQuery("", "", "", "", "", "中国")
+        return search_article.search_article(query, FacetFilters(), per_page=10, page_id=0)
+
+    def test_answered_search_is_served_stale(self):
+        self._search()
+        self.assertIn("publisher", self.es.bodies[-1]["aggs"])
+        self.es.available = False
+        # facet counts are cached now, so the repeated search leaves out the facet aggregations
+        table, _, _ = self._search()
+        html = search_article.to_xml(table)
+        self.assertIn("Search service is degraded", html)
+        self.assertIn("<mark>中国</mark>", html)
+        self.assertEqual(len(search_backend.result_cache), 1)
+
+    def test_page_change_shares_the_cached_response(self):
+        self._search()
+        self._search()
+        self.assertNotIn("publisher", self.es.bodies[-1]["aggs"])
+        self.assertEqual(len(search_backend.result_cache), 1)
+
+if __name__ == "__main__":
+    unittest.main()